@@ -12,6 +12,7 @@ import numpy as np
 
 from lib.cli import CLI
 from lib.utils import Logger
+from lib.store import iter_data
 
 import sys, argparse, matplotlib
 
@@ -24,14 +25,13 @@ def split_array(arr, pos):
 
 
 def combine_arrays(array_files):
-    matrix = None
-    for network in array_files:
-        if matrix is None:
-            matrix = np.loadtxt(network)
-        else:
-            matrix = np.vstack([matrix, np.loadtxt(network)])
+    # array_files can also name result store datasets (<store>:<dataset>)
+    networks = [network for _, _, _, network in iter_data(array_files)]
+
+    if len(networks) == 1:
+        return networks[0]
 
-    return matrix
+    return np.vstack(networks)
 
 
 def plot_graph(network, err=None, start_x=1, color="black", ecolor="red", title="Title", x_label="X", y_label="Y", ylim=None):
@@ -141,7 +141,7 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser()
 
     #custom arguments
-    parser.add_argument("--data", help="The .dat files that will be averaged", nargs="*")
+    parser.add_argument("--data", help="The .dat files (or result store datasets, e.g. wt.store:bc) that will be averaged", nargs="*")
     parser.add_argument("--data-type", help="Type of data - BC/delta-BC/L/delta-L")
 
     parser.add_argument("--prefix", help="Prefix used to name outputs", default="network")
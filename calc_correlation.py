@@ -13,85 +13,117 @@ import numpy as np
 
 from lib.cli import CLI
 from lib.utils import Logger
-from lib.trajectory import load_trajectory
+from lib.trajectory import load_trajectory, load_topology, select_nodes, count_frames, frame_range, parse_shard, CoordinateIterator, CoordinateCache
+from lib.checkpoint import save_checkpoint
+from lib.correlation import cross_correlation, reduce_matrix, open_matrix, sliding_windows, DCCAccumulator
 
-import argparse, math, matplotlib
+import argparse, matplotlib
 
 matplotlib.use('Agg')
 import matplotlib.pyplot as plt
 
+# larger correlation matrices are averaged over blocks of residues for plotting
+MAX_PLOT_SIZE = 1000
 
-def parse_traj(traj, topology=None, step=1, selected_atoms=["CA"], lazy_load=False):
-    traj = load_trajectory(traj, topology, step, lazy_load)[0]
 
-    residues = {}
+def select_residues(traj, topology=None, selected_atoms=["CA"]):
+    # the selected atoms (to be read from the trajectory), the order in which
+    # their co-ordinates are correlated and the (chain index, residue number)
+    # of each correlated residue - residues are ordered by chain and residue
+    # number, residues with the same number in different chains are kept
+    # apart and a residue with more than one selected atom is represented by
+    # the first of them
+    atoms, nodes = select_nodes(load_topology(traj, topology), " or ".join("name %s" % name for name in selected_atoms))
 
-    for frame in traj:
-        for atom in frame.topology.atoms:
-            if atom.name in selected_atoms:
-                res = atom.residue.resSeq
+    order = np.lexsort((nodes["resSeq"], nodes["chain"]))
+    chains, numbers = nodes["chain"][order], nodes["resSeq"][order]
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = (chains[1:] != chains[:-1]) | (numbers[1:] != numbers[:-1])
 
-                ac = frame.xyz[0, atom.index]
-                co_ords = [ac[0], ac[1], ac[2]]
+    return atoms, order[first], list(zip(chains[first].tolist(), numbers[first].tolist()))
 
-                if res in residues:
-                    residues[res].append(co_ords)
-                else:
-                    residues[res] =  [co_ords]
 
-    return residues
+def iter_coords(traj, topology=None, step=1, selected_atoms=["CA"], lazy_load=False, skip=0, n_frames=None, cache=None, chunk=100, prefetch=0):
+    # only the selected atoms are read from the trajectory (or a
+    # CoordinateCache) - skip and n_frames limit the frames read to a range
+    # and a lazily loaded trajectory is read chunk frames at a time, prefetch
+    # chunks ahead (see load_trajectory). Returns the (chain index, residue
+    # number) of the residues (see select_residues), the number of frames and
+    # an iterator over chunks of (T, N, 3) co-ordinates.
+    atoms, order, residues = select_residues(traj, topology, selected_atoms)
 
+    path = traj
+    traj, total_frames = load_trajectory(path, topology, step, lazy_load, chunk, atoms, skip, n_frames, cache, prefetch)
+    if total_frames is None:
+        total_frames = max(0, -(-count_frames(path) // (step or 1)) - skip)
 
+    return residues, total_frames, (xyz for xyz, _, _ in CoordinateIterator(traj, chunk, order).chunks())
 
-def mean_dot(m1, m2, size):
-    DOT = np.zeros(size)
 
-    for t in range(size):
-        DOT[t] = np.dot(m1[t],m2[t])
+def parse_traj(traj, topology=None, step=1, selected_atoms=["CA"], lazy_load=False, skip=0, n_frames=None, cache=None, chunk=100, prefetch=0):
+    # returns the (T, N, 3) co-ordinates of the N residues and their (chain
+    # index, residue number) - see iter_coords
+    residues, total_frames, chunks = iter_coords(traj, topology, step, selected_atoms, lazy_load, skip, n_frames, cache, chunk, prefetch)
 
-    return np.mean(DOT)
+    # the co-ordinates are copied into place a chunk of frames at a time -
+    # the array only grows if the trajectory has more frames than its header
+    # reports
+    coords = np.zeros((total_frames, len(residues), 3), dtype=np.float32)
+    row = 0
 
+    for xyz in chunks:
+        if row + len(xyz) > len(coords):
+            coords = np.concatenate((coords, np.zeros((row + len(xyz) - len(coords), len(residues), 3), dtype=np.float32)))
 
+        coords[row:row + len(xyz)] = xyz
+        row += len(xyz)
 
-def correlate(residues):
+    return coords[:row], residues
 
-    sorted_residues = sorted(residues.keys())
 
-    num_trajectories = len(residues[sorted_residues[0]])
-    num_residues = len(residues)
+def accumulate_traj(traj, topology=None, step=1, selected_atoms=["CA"], lazy_load=False, skip=0, n_frames=None, cache=None, chunk=100, prefetch=0, block_size=None, path=None):
+    # as parse_traj, but each chunk of frames is added to a DCCAccumulator
+    # and dropped, so the memory used does not grow with the number of
+    # frames - with a path, the co-moments are memory-mapped from that file
+    # and updated block_size x block_size tiles at a time, so that it does
+    # not grow with the square of the number of residues either. Returns the
+    # accumulator and the residues.
+    residues, _, chunks = iter_coords(traj, topology, step, selected_atoms, lazy_load, skip, n_frames, cache, chunk, prefetch)
 
-    correlation = np.zeros((num_residues, num_residues))
+    accumulator = DCCAccumulator(block_size=block_size, path=path)
+    for xyz in chunks:
+        accumulator.add(xyz)
 
-    for a, key_a in enumerate(sorted_residues):
-        i = residues[key_a]
-        resI = np.array(i)
-        meanI = np.tile((np.mean(resI, 0)),(num_trajectories, 1))
-        idelta = resI - meanI;
-        magnitudeI = math.sqrt(mean_dot(idelta, idelta, num_trajectories))
+    return accumulator, residues
 
-        for b, key_b in enumerate(sorted_residues):
-            j = residues[key_b]
-            resJ = np.array(j)
-            meanJ = np.tile((np.mean(resJ, 0)),(num_trajectories, 1))
-            jdelta = resJ - meanJ
-            magnitudeJ = math.sqrt(mean_dot(jdelta, jdelta, num_trajectories))
 
-            meanDotIJ = mean_dot(idelta, jdelta, num_trajectories)
-            magProd = magnitudeI * magnitudeJ
+def comoment_path(block_size, prefix):
+    # with --block-size, accumulated co-moments are memory-mapped from
+    # <prefix>_comoment.npy rather than held in memory
+    return "%s_comoment.npy" % prefix if block_size else None
 
-            correlation[a,b] = meanDotIJ/magProd
 
-    return correlation
+def window_summary(correlation, previous=None):
+    # mean, mean absolute value and standard deviation of the correlations
+    # between different residues, and the root mean square change from the
+    # previous window's matrix (nan for the first window)
+    values = correlation[~np.eye(len(correlation), dtype=bool)]
+    change = np.nan if previous is None else np.sqrt(np.mean((correlation - previous)**2))
+
+    return np.mean(values), np.mean(np.abs(values)), np.std(values), change
 
 
 def plot_map(correlation, title, output_prefix):
-    M = np.array(correlation)
+    # matrices of more than MAX_PLOT_SIZE residues are averaged over blocks of
+    # residues, read a block of rows at a time (see lib.correlation)
+    M = reduce_matrix(correlation, MAX_PLOT_SIZE)
+    n_rows, n_cols = correlation.shape
 
     ax = plt.subplots()[1]
     colors = [('white')] + [(cm.jet(i)) for i in range(40,250)]
 
     new_map = matplotlib.colors.LinearSegmentedColormap.from_list('new_map', colors, N=300)
-    heatmap = ax.pcolor(M, cmap=new_map, vmin=-1, vmax=1)
+    heatmap = ax.pcolor(np.linspace(0, n_cols, M.shape[1] + 1), np.linspace(0, n_rows, M.shape[0] + 1), M, cmap=new_map, vmin=-1, vmax=1)
 
     fig = plt.gcf()
     ax.set_frame_on(False)
@@ -120,28 +152,132 @@ def plot_map(correlation, title, output_prefix):
 
 
 
-def print_correlation(correlation, output_prefix):
+def print_correlation(correlation, output_prefix, block_size=256):
+    # one line of space-separated values per row, formatted as str() formats
+    # them - rows are read and written block_size at a time
     with open("%s.txt" % output_prefix, "w") as w:
-        rows = correlation.shape[0]
-        cols = correlation.shape[1]
+        for start in range(0, correlation.shape[0], block_size):
+            block = np.asarray(correlation[start:start + block_size])
+            rows = [map(repr, row) for row in block.tolist()] if block.dtype == np.float64 else block.astype(str).tolist()
+
+            w.write("".join("%s \n" % " ".join(row) for row in rows))
 
-        for r in range(rows):
-            for c in range(cols):
-                w.write('%s ' % str(correlation[r,c]))
-            w.write('\n')
+
+def save_correlation(correlation, title, output_prefix, text=True):
+    # the matrix itself is already in <prefix>.npy (see open_matrix)
+    log.info("Plotting heat map...\n")
+    plot_map(correlation, title, output_prefix)
+
+    if text:
+        print_correlation(correlation, output_prefix)
 
 
 
 def main(args):
-    log.info("Preparing a trajectory matrix...\n")
-    traj_matrix = parse_traj(args.trajectory, args.topology, args.step, lazy_load=args.lazy_load)
+    frames = frame_range(args.trajectory, args.step, args.frame_start, args.frame_end, args.shard)
+    if args.window:
+        calc_windows(args, frames)
+        return
+
+    if frames is not None:
+        calc_range(args, frames)
+        return
 
-    log.info("Correlating...\n")
-    correlation = correlate(traj_matrix)
+    # the matrix is written a tile at a time to <prefix>.npy
+    if args.lazy_load:
+        # the trajectory is correlated as it is read
+        log.info("Accumulating correlations...\n")
+        accumulator, residues = accumulate_traj(args.trajectory, args.topology, args.step, lazy_load=True, cache=get_cache(args), chunk=args.chunk_size, prefetch=args.prefetch,
+                                                block_size=args.block_size, path=comoment_path(args.block_size, args.prefix))
+        correlation = accumulator.correlation(args.block_size, open_matrix("%s.npy" % args.prefix, len(residues)))
+        accumulator.discard()
+    else:
+        log.info("Preparing a trajectory matrix...\n")
+        coords, residues = parse_traj(args.trajectory, args.topology, args.step, cache=get_cache(args), chunk=args.chunk_size, prefetch=args.prefetch)
 
-    log.info("Plotting heat map...\n")
-    plot_map(correlation, args.title, args.prefix)
-    print_correlation(correlation, args.prefix)
+        log.info("Correlating...\n")
+        dtype = np.float32 if args.single_precision else np.float64
+        correlation = cross_correlation(coords, dtype, args.block_size, open_matrix("%s.npy" % args.prefix, len(residues), dtype))
+
+    save_correlation(correlation, args.title, args.prefix, not args.discard_text)
+
+
+def get_cache(args):
+    return CoordinateCache(args.cache_dir, int(args.cache_size * 2**30)) if args.cache_dir else None
+
+
+def calc_range(args, frames):
+    # correlation over a range of frames (--frame-start/--frame-end/--shard).
+    # Outputs are tagged with the range (e.g. correlation_frames0-250.txt)
+    # and the accumulated co-moments are saved to
+    # <prefix>_frames0-250.partial (with --block-size, the co-moments
+    # themselves stay in <prefix>_frames0-250_comoment.npy), to be merged with
+    # those of the other ranges by merge_shards.py.
+    first, stop, total = frames
+    prefix = "%s_frames%d-%d" % (args.prefix, first, stop)
+
+    log.info("Accumulating correlations over frames %d to %d of %d...\n" % (first + 1, stop, total))
+    accumulator, residues = accumulate_traj(args.trajectory, args.topology, args.step, lazy_load=args.lazy_load, skip=first, n_frames=stop - first, cache=get_cache(args), chunk=args.chunk_size, prefetch=args.prefetch,
+                                            block_size=args.block_size, path=comoment_path(args.block_size, prefix))
+
+    if not accumulator.count:
+        log.error("No frames were read - the range is empty\n")
+        return
+
+    save_checkpoint("%s.partial" % prefix, {"kind": "correlation", "frames": frames, "prefix": args.prefix, "title": args.title, "residues": residues, "accumulator": accumulator})
+
+    correlation = accumulator.correlation(args.block_size, open_matrix("%s.npy" % prefix, len(residues)))
+    save_correlation(correlation, args.title, prefix, not args.discard_text)
+
+
+def calc_windows(args, frames=None):
+    # time-resolved correlation over windows of --window frames starting
+    # every --window-step frames (within the --frame-start/--frame-end/--shard
+    # range, if given). The trajectory is read once and each window's
+    # correlations are updated from the previous window's (see
+    # lib.correlation.sliding_windows). The matrices of the windows are
+    # stacked in <prefix>_windows.npy (window, N, N) and summary statistics
+    # of each window are written to <prefix>_windows.txt.
+    first, stop = (0, None) if frames is None else frames[:2]
+    window, step = args.window, args.window_step or args.window
+    if window < 2 or step < 1:
+        log.error("--window must be at least 2 frames and --window-step at least 1\n")
+        return
+
+    log.info("Reading trajectory...\n")
+    residues, total_frames, chunks = iter_coords(args.trajectory, args.topology, args.step, lazy_load=args.lazy_load, skip=first, n_frames=None if stop is None else stop - first, cache=get_cache(args), chunk=args.chunk_size, prefetch=args.prefetch)
+
+    n_windows = max(0, (total_frames - window) // step + 1)
+    if not n_windows:
+        log.error("The trajectory has fewer than %d frames - no window to correlate\n" % window)
+        return
+
+    stack = None
+    if not args.window_summary:
+        stack = np.lib.format.open_memmap("%s_windows.npy" % args.prefix, mode="w+", dtype=np.float64, shape=(n_windows, len(residues), len(residues)))
+
+    summary, previous, accumulator = [], None, None
+    for index, accumulator in enumerate(sliding_windows(chunks, window, step, block_size=args.block_size, path=comoment_path(args.block_size, "%s_windows" % args.prefix))):
+        if index == n_windows:
+            break
+
+        log.info("Correlating window %d/%d\r" % (index + 1, n_windows))
+
+        correlation = accumulator.correlation(args.block_size, None if stack is None else stack[index])
+        start = first + index * step
+        summary.append((index, start, start + window) + window_summary(correlation, previous))
+        previous = correlation
+
+    log.info("\n")
+
+    if accumulator is not None:
+        accumulator.discard()
+
+    if len(summary) < n_windows:
+        log.error("Only %d of the %d windows could be read - the remaining matrices in %s_windows.npy are empty\n" % (len(summary), n_windows, args.prefix))
+
+    np.savetxt("%s_windows.txt" % args.prefix, summary, fmt=["%d", "%d", "%d", "%.6f", "%.6f", "%.6f", "%.6f"],
+               header="window first_frame end_frame mean_correlation mean_abs_correlation std_correlation rms_change")
 
 
 log = Logger()
@@ -155,7 +291,22 @@ if __name__ == "__main__":
     parser.add_argument("--trajectory", help="Trajectory file", required=True)
     parser.add_argument("--topology", help="Referencce PDB file (must contain the same number of atoms as the trajectory)", required=True)
     parser.add_argument("--step", help="Size of the step to take when iterating the the trajectory frames", type=int)
-    parser.add_argument("--lazy-load", help="Iterate through trajectory, loading one frame into memory at a time (memory-efficient for large trajectories)", action='store_true', default=False)
+    parser.add_argument("--lazy-load", help="Iterate through trajectory, loading one chunk of frames into memory at a time and accumulating the correlations as it is read (memory-efficient for large trajectories)", action='store_true', default=False)
+    parser.add_argument("--chunk-size", help="Number of frames read from the trajectory at a time with --lazy-load (default: 100)", default=100, type=int)
+    parser.add_argument("--prefetch", help="Number of chunks read ahead in a background thread while the current chunk is processed, with --lazy-load or when adding the trajectory to the --cache-dir cache (default: 0 - read chunks when they are needed)", default=0, type=int)
+    parser.add_argument("--cache-dir", help="Directory of a co-ordinate cache shared by the MD-TASK tools - the co-ordinates of the selected atoms are read from the trajectory once and memory-mapped from the cache by later runs (default: no cache)", default=None)
+    parser.add_argument("--cache-size", help="Maximum size of the --cache-dir cache in GB - the least recently used trajectories are removed (default: 10)", default=10, type=float)
+    parser.add_argument("--frame-start", help="Index of the first trajectory frame to correlate (default: 0)", default=None, type=int)
+    parser.add_argument("--frame-end", help="Index of the trajectory frame to stop before (default: the end of the trajectory)", default=None, type=int)
+    parser.add_argument("--shard", help="Only correlate part i of n equal parts of the frames (e.g. 2/4) - combine the shards with merge_shards.py", default=None, type=parse_shard)
+
+    parser.add_argument("--single-precision", help="Correlate in single precision, halving the memory used, without --lazy-load (default: double precision)", action='store_true', default=False)
+    parser.add_argument("--block-size", help="Number of rows and columns of the tiles the correlation matrix is calculated in, to limit the memory used for large systems - with --lazy-load, --window or a range of frames, the accumulated co-moments are also memory-mapped from <prefix>_comoment.npy rather than held in memory (default: the whole matrix at once, in memory)", default=None, type=int)
+    parser.add_argument("--discard-text", help="Only save the correlation matrix in binary (<prefix>.npy), not as text (<prefix>.txt)", action='store_true', default=False)
+
+    parser.add_argument("--window", help="Correlate windows of this many frames instead of the whole trajectory - the matrices of the windows are saved to <prefix>_windows.npy and their summary statistics to <prefix>_windows.txt (default: no windows)", default=None, type=int)
+    parser.add_argument("--window-step", help="Number of frames between the starts of consecutive windows (default: the window size)", default=None, type=int)
+    parser.add_argument("--window-summary", help="Only save the summary statistics of the windows, not their matrices", action='store_true', default=False)
 
     parser.add_argument("--title", help="Title for heatmap", default="Protein")
     parser.add_argument("--prefix", help="Prefix for output files", default="correlation")
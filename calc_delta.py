@@ -13,46 +13,78 @@ from natsort import natsorted
 from lib.cli import CLI
 from lib.utils import Logger
 from lib.strategies import normalization
+from lib.store import ResultStore, iter_data, load_data, parse_spec
+from lib.plots import PlotQueue, plot_nodes, plot_summary
 
 import numpy as np
 
-import sys, argparse, matplotlib
+import sys, argparse
 
-matplotlib.use('Agg')
-import matplotlib.pyplot as plt
 
+def load_reference(spec):
+    # the reference must be a single matrix - a store dataset is only taken
+    # without a frame index if it holds a single frame
+    parsed = parse_spec(spec)
 
-def calc_delta(reference_file, alternative_files, normalizer, generate_plots=False):
-    reference = np.loadtxt(reference_file)
-    num_nodes = reference.shape[0]
+    if parsed is not None and parsed[2] is None:
+        with ResultStore(parsed[0]) as store:
+            frames = store.frames(parsed[1])
+
+        if len(frames) != 1:
+            log.error("--reference %s holds %d frames - give the frame to use as the reference, e.g. %s:%d\n" % (spec, len(frames), spec, frames[0] if frames else 0))
+            sys.exit(1)
+
+        spec = "%s:%d" % (spec, frames[0])
+
+    return load_data(spec)
+
+
+def calc_delta(reference_file, alternative_files, normalizer, generate_plots=False, output_store=None, plot_workers=0, summary_plot=False, prefix=None):
+    reference = load_reference(reference_file)
 
     label = normalizer.get_label()
 
-    alternatives = natsorted(alternative_files)
+    # text files are sorted by name, store datasets are read in frame order
+    alternatives = natsorted(f for f in alternative_files if parse_spec(f) is None)
+    alternatives += [f for f in alternative_files if parse_spec(f) is not None]
+
+    log.info("Calculating %s for %s...\n" % (label, ", ".join(alternatives) if len(alternatives) < 4 else "%d inputs" % len(alternatives)))
+
+    store = ResultStore(output_store, "a") if output_store else None
+    summary = []
+
+    with PlotQueue(plot_workers if generate_plots else 0) as plots:
+        for i, (title, frame, time, alternative) in enumerate(iter_data(alternatives)):
+            log.info("Calculating %s (%d networks completed)\r" % (label, i + 1))
+
+            difference = alternative - reference
+            difference = normalizer.normalize(difference, reference)
+            output = "%s_%s_delta_%s" % (title, normalizer.get_prefix(), normalizer.matrix_type)
 
-    log.info("Calculating %s for %d networks...\n" % (label, len(alternatives)))
+            # deltas of stored frames keep their frame index and time
+            if store is not None:
+                store.append(i if frame is None else frame, i if time is None else time, "delta_%s" % normalizer.matrix_type, difference)
+            else:
+                np.savetxt("%s.dat" % output, difference)
 
-    for i, alternative in enumerate(alternatives):
-        log.info("Calculating %s (%d/%d)\r" % (label, i + 1, len(alternatives)))
+            if generate_plots:
+                plots.submit(plot_nodes, difference, "%s.png" % output, "%s %s" % (title, label), "Residue Numbers", label, zero_line=True)
 
-        title = ".".join(alternative.split(".")[:-1])
-        alternative = np.loadtxt(alternative)
+            if summary_plot:
+                summary.append((i if time is None else time, np.ravel(difference)))
 
-        difference = alternative - reference
-        difference = normalizer.normalize(difference, reference)
-        prefix = "%s_%s_delta_%s" % (title, normalizer.get_prefix(), normalizer.matrix_type)
+    if store is not None:
+        store.close()
 
-        np.savetxt("%s.dat" % prefix, difference)
+    if summary:
+        # named after the reference (without --prefix), as the files of each
+        # alternative are named after the alternative
+        if prefix is None:
+            parsed = parse_spec(reference_file)
+            prefix = ".".join((reference_file if parsed is None else parsed[0]).split(".")[:-1])
 
-        if generate_plots:
-            node_axis = range(1, num_nodes + 1)
-            plt.plot(node_axis, difference)
-            plt.axhline(0, color='black')
-            plt.title("%s %s" % (title, label), fontsize=18)
-            plt.xlabel('Residue Numbers', fontsize=16)
-            plt.ylabel(label, fontsize=16)
-            plt.savefig("%s.png" % prefix, dpi=300, bbox_inches="tight")
-            plt.close()
+        name = "_".join(part for part in (prefix, normalizer.get_prefix(), "delta", normalizer.matrix_type, "summary") if part)
+        plot_summary(np.vstack([d for _, d in summary]), "%s.png" % name, label, [t for t, _ in summary], "Residue Numbers", label)
 
     log.info("\n")
 
@@ -78,7 +110,8 @@ def main(args):
     else:
         normalizer = normalization.none(args.matrix_type)
 
-    calc_delta(args.reference, args.alternatives, normalizer, args.generate_plots)
+    calc_delta(args.reference, args.alternatives, normalizer, args.generate_plots, getattr(args, "output_store", None),
+        getattr(args, "plot_workers", 0), getattr(args, "summary_plot", False), getattr(args, "prefix", None))
 
 
 log = Logger()
@@ -87,10 +120,14 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser()
 
     parser.add_argument("--matrix-type", help="The type of values in the matrices i.e. BC or L", default=None)
-    parser.add_argument("--reference", help="The reference matrix (.dat)")
-    parser.add_argument("--alternatives", help="The alternative matrices (.dat)", nargs="*")
+    parser.add_argument("--reference", help="The reference matrix (.dat or a stored frame, e.g. wt.store:bc:0)")
+    parser.add_argument("--alternatives", help="The alternative matrices (.dat or result store datasets, e.g. wt.store:bc)", nargs="*")
+    parser.add_argument("--output-store", help="Append the deltas to this result store (as dataset delta_<matrix type>) instead of writing .dat files", default=None)
     parser.add_argument("--normalize", help="Normalizes the values", action='store_true', default=False)
     parser.add_argument('--normalization-mode', help="Method used to normalize (default for L = standard, default for BC = plusone)", default=None)
     parser.add_argument("--generate-plots", help="Plot results - without setting this flag, no graph will be generated", action='store_true', default=False)
+    parser.add_argument("--plot-workers", help="Number of background processes used to render the --generate-plots figures (default: 0 - render in the main process)", default=0, type=int)
+    parser.add_argument("--summary-plot", help="Plot the deltas of all alternatives in a single figure", action='store_true', default=False)
+    parser.add_argument("--prefix", help="Prefix of the --summary-plot figure (<prefix>_<normalization>_delta_<matrix type>_summary.png - default: the name of the reference)", default=None)
 
     CLI(parser, main, log)
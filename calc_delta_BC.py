@@ -26,8 +26,12 @@ if __name__ == "__main__":
 
     parser.add_argument("--reference", help="The reference BC matrix (.dat)")
     parser.add_argument("--alternatives", help="The alternative BC matrices (.dat)", nargs="*")
+    parser.add_argument("--output-store", help="Append the deltas to this result store (as dataset delta_BC) instead of writing .dat files", default=None)
     parser.add_argument("--normalize", help="Normalizes the values", action='store_true', default=False)
     parser.add_argument('--normalization-mode', help="Method used to normalize - default: (Delta BC/(BC+1))", default=None)
     parser.add_argument("--generate-plots", help="Plot results - without setting this flag, no graph will be generated", action='store_true', default=False)
+    parser.add_argument("--plot-workers", help="Number of background processes used to render the --generate-plots figures (default: 0 - render in the main process)", default=0, type=int)
+    parser.add_argument("--summary-plot", help="Plot the deltas of all alternatives in a single figure", action='store_true', default=False)
+    parser.add_argument("--prefix", help="Prefix of the --summary-plot figure (<prefix>_<normalization>_delta_<matrix type>_summary.png - default: the name of the reference)", default=None)
 
     CLI(parser, main, log)
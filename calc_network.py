@@ -11,161 +11,686 @@
 
 from lib.cli import CLI
 from lib.utils import Logger
-from lib.trajectory import load_trajectory, calc_distance
+from lib.trajectory import load_trajectory, load_topology, select_nodes, get_atom_filter, CoordinateIterator, CoordinateCache, find_contacts, find_contacts_batch, frame_range, parse_shard
+from lib.store import ResultStore
+from lib.graphs import GraphArchive
+from lib.stats import FrameAverages
+from lib.checkpoint import save_checkpoint, load_checkpoint, FrameLog
+from lib.plots import PlotQueue, plot_nodes, plot_summary
+from lib.network import adjacency, batch_adjacency, shortest_path_lengths, betweenness_centrality, approximate_betweenness_centrality, IncrementalNetwork, MAX_EDGE_CHANGES, ContactPersistence, weighted_shortest_path_lengths
 
 import numpy as np
 import networkx as nx
 
-import os, sys, argparse, matplotlib
+import os, sys, argparse, collections, multiprocessing
 
-matplotlib.use('Agg')
-import matplotlib.pyplot as plt
 
+def construct_graph(frame, ligands=None, prefix="frame", threshold=6.7, save_graph=True, atoms=None):
+    # atoms can be given (from select_nodes) to skip resolving the selection
+    if atoms is None:
+        atoms = frame.topology.select(get_atom_filter(ligands))
 
-def construct_graph(frame, ligands=None, prefix="frame", threshold=6.7, save_graph=True):
-    atom_filter = "(name CB and protein) or (name CA and resname GLY)"
-    if ligands:
-        ligands = ligands.split(",")
+    box = None if frame.unitcell_vectors is None else frame.unitcell_vectors[0]
+    edges = find_contacts(frame.xyz[0, atoms], threshold / 10., box)
 
-        for ligand in ligands:
-            arr = ligand.split(":")
-            atom_filter += " or (name %s and resname %s)" % (arr[1], arr[0])
+    protein_graph = build_graph(len(atoms), edges)
 
-    atoms = frame.topology.select(atom_filter)
-
-    nodes_range = len(atoms)
+    if save_graph:
+        write_graph(protein_graph, prefix)
 
-    nodes = range(0, len(atoms))
-    edges = []
+    return protein_graph
 
-    for i in range(nodes_range - 1):
-        for j in range(i + 1, nodes_range):
-            dist = calc_distance(frame, atoms[i], atoms[j]) * 10
-            if dist < threshold:
-                edges.append((i, j))
 
+def build_graph(num_nodes, edges):
     protein_graph = nx.Graph()
-    protein_graph.add_nodes_from(nodes)
-    protein_graph.add_edges_from(edges)
-
-    if save_graph:
-        nx.write_gml(protein_graph, "%s_graph.gml" % prefix)
-        nx.write_graphml(protein_graph, "%s_graph.graphml" % prefix)
+    protein_graph.add_nodes_from(range(0, num_nodes))
+    protein_graph.add_edges_from(edges.tolist())
 
     return protein_graph
 
 
-def calc_shortest_paths(traj, traj_name, total_frames, args):
-    log.info("Calculating shortest paths...\n")
+def write_graph(protein_graph, prefix):
+    nx.write_gml(protein_graph, "%s_graph.gml" % prefix)
+    nx.write_graphml(protein_graph, "%s_graph.graphml" % prefix)
+
+
+def iter_frames(traj, args, start=0, batch_bc=False):
+    # yields (frame index, frame time, node co-ordinates, unit cell vectors,
+    # contact pairs, BC) for every frame - the trajectory only holds the node
+    # atoms (see main) and the contacts are only found up front (for a whole
+    # chunk) when --batch-contacts is set. With batch_bc, the BC of the whole
+    # chunk is calculated at once as well. start is the index of the
+    # trajectory's first frame when resuming.
+    current = start
+
+    for xyz, times, boxes in CoordinateIterator(traj, args.chunk_size).chunks():
+        if args.batch_contacts:
+            contacts = find_contacts_batch(xyz, args.threshold / 10., box=boxes)
+        else:
+            contacts = [None] * len(xyz)
+
+        centralities = [None] * len(xyz)
+        if batch_bc:
+            try:
+                centralities = batch_betweenness(xyz.shape[1], contacts)
+            except Exception as ex:
+                # left to calc_frame, which reports the error of each frame
+                log.warn("type=general:frames=%d-%d:message=BC could not be calculated for the whole chunk (%s) - calculating it per frame\n" % (current + 1, current + len(xyz), str(ex)))
+
+        if boxes is None:
+            boxes = [None] * len(xyz)
+
+        for time, frame_xyz, box, edges, bc in zip(times, xyz, boxes, contacts, centralities):
+            yield current, time, frame_xyz, box, edges, bc
+            current += 1
+
 
-    for current, frame in enumerate(traj):
+def calc_frame(task):
+    # builds the network for a single frame and calculates each of the
+    # requested metrics from it - this runs in a worker process when
+    # --workers is set, so every result (or error) is returned to the parent
+    # to be written out
+    current, time, xyz, box, edges, bc, settings = task
+    metrics = settings["metrics"]
+    network = settings["network"]
+    num_nodes = len(xyz)
+
+    try:
+        if edges is None:
+            edges = find_contacts(xyz, settings["cutoff"], box)
+
+        if network is not None:
+            network.update(num_nodes, edges)
+
+    except Exception as ex:
+        return current, time, num_nodes, edges, dict((metric, ex) for metric in metrics)
+
+    results = {}
+    for metric in metrics:
         try:
-            if total_frames:
-                log.info("Progress: %d/%d\r" % (current + 1, total_frames))
-            else:
-                log.info("Progress: %d frames completed\r" % (current + 1))
+            if metric == "BC" and bc is not None:
+                results[metric] = bc
+            elif metric == "BC" and settings["bc_samples"]:
+                # seeded per frame so that results do not depend on --workers
+                seed = None if settings["seed"] is None else [settings["seed"], current]
+                indptr, indices = adjacency(num_nodes, edges)
+                results[metric], results["BC error"] = approximate_betweenness_centrality(indptr, indices, settings["bc_samples"], seed)
+            elif metric == "BC" and network is not None:
+                results[metric] = network.betweenness(lambda num_nodes, edges: betweenness(num_nodes, edges, settings["bc_backend"]))
+            elif metric == "BC":
+                results[metric] = betweenness(num_nodes, edges, settings["bc_backend"])
+            elif metric == "L":
+                results[metric] = shortest_path_matrix(num_nodes, edges, network)
+        except Exception as ex:
+            results[metric] = ex
+
+    return current, time, num_nodes, edges, results
+
+
+def iter_results(traj, args, metrics, start=0):
+    # yields the output of calc_frame for every frame, in frame order
+    settings = {
+        "cutoff": args.threshold / 10.,
+        "metrics": metrics,
+        "bc_backend": args.bc_backend,
+        "bc_samples": args.bc_approx,
+        "seed": args.seed,
+        "network": IncrementalNetwork(args.max_edge_changes) if args.incremental else None
+    }
+
+    # with --bc-backend csr and --batch-contacts, the networks of a chunk of
+    # frames are stacked into one block-diagonal graph and their BC is
+    # calculated together (in this process, so not with --workers)
+    batch_bc = "BC" in metrics and args.bc_backend == "csr" and args.batch_contacts and not args.bc_approx and not args.incremental and args.workers <= 1
+
+    tasks = ((current, time, xyz, box, edges, bc, settings) for current, time, xyz, box, edges, bc in iter_frames(traj, args, start, batch_bc))
+
+    if args.workers <= 1:
+        for task in tasks:
+            yield calc_frame(task)
+        return
+
+    pool = multiprocessing.Pool(args.workers)
+    pending = collections.deque()
+
+    try:
+        for task in tasks:
+            pending.append(pool.apply_async(calc_frame, (task,)))
+
+            # only keep a few frames per worker in flight so that lazily
+            # loaded trajectories are not read far ahead of the calculation
+            if len(pending) >= 4 * args.workers:
+                yield pending.popleft().get()
+
+        while pending:
+            yield pending.popleft().get()
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def log_progress(current, total_frames):
+    if total_frames:
+        log.info("Progress: %d/%d\r" % (current + 1, total_frames))
+    else:
+        log.info("Progress: %d frames completed\r" % (current + 1))
+
+
+def output_prefix(traj_name, frames=None):
+    # prefix of the outputs that cover all frames of a run (averages,
+    # summary plots, consensus network, graph archive and checkpoint) - runs
+    # over part of the trajectory (--frame-start/--frame-end/--shard) are
+    # tagged with their range of frames, e.g. wt_frames0-250
+    prefix = ".".join(traj_name.split(".")[:-1])
+
+    if frames is not None:
+        prefix = "%s_frames%d-%d" % (prefix, frames[0], frames[1])
+
+    return prefix
+
+
+def calc_networks(traj, traj_name, total_frames, args, metrics, state=None, checkpoint=None, frames=None):
+    # single pass through the trajectory - each frame's network is built once
+    # and every requested metric is calculated from it. The progress and the
+    # running accumulators are kept in state, which is saved to the
+    # checkpoint file every --checkpoint-interval frames (see --resume). The
+    # per-frame records of the summary and consensus are appended to logs
+    # next to the checkpoint rather than saved with it.
+    names = {"BC": "betweenness centralities", "L": "shortest paths"}
+
+    # only a resumed run adds to the outputs of an earlier one - any other
+    # run replaces them, so that no frames of a previous run are left behind
+    mode = "a" if state is not None else "w"
+
+    if state is None:
+        state = new_state(traj_name, args, metrics, frames, checkpoint)
+    else:
+        for name in ("summary", "contacts"):
+            if state[name] is not None:
+                state[name].reopen()
+
+    prefix = output_prefix(traj_name, state["frames"])
+
+    # with --consensus, only the contacts are found for each frame and the
+    # metrics are calculated once, on the consensus network
+    persistence = load_persistence(state) if args.consensus else None
+    frame_metrics = metrics
+
+    if persistence is not None:
+        frame_metrics = ()
+        log.info("Accumulating contact persistence...\n")
+    else:
+        log.info("Calculating %s...\n" % " and ".join(names[metric] for metric in metrics))
+
+    # a resumed run drops the frames written to the store and graph archive
+    # after its checkpoint, as it does those of the logs
+    store = ResultStore(args.store, mode, state["store_end"]) if args.store else None
+    summary = state["summary"]
+    averages = state["averages"]
+    interval = getattr(args, "checkpoint_interval", 0)
+
+    # the networks of all frames go to a single graph archive (convert
+    # frames to gml/graphml with convert_graphs.py)
+    graphs = None
+    if args.discard_graphs:
+        archive = args.graph_archive or "%s_graphs.mdg" % prefix
+        graphs = GraphArchive(archive, mode, args.compress_graphs, state["graphs_end"])
+
+    try:
+        with PlotQueue(args.plot_workers if args.generate_plots else 0) as plots:
+            for current, time, num_nodes, edges, results in iter_results(traj, args, frame_metrics, state["frame"] + 1):
+                log_progress(current, total_frames)
+
+                if persistence is not None:
+                    if edges is None:
+                        log.error("type=general:frame=%d:message=Contacts could not be found\n" % (current + 1))
+                    else:
+                        persistence.add(num_nodes, edges)
+                        if state["contacts"] is not None:
+                            state["contacts"].append((num_nodes, edges))
+
+                failed = save_results(current, time, num_nodes, edges, results, traj_name, args, frame_metrics, store, plots, summary, graphs, averages)
+                if edges is None:
+                    failed.append("contacts")
+
+                # every output of the frame has been written at this point
+                if failed:
+                    state["failed"][current] = failed
+                state["frame"] = current
+                state["times"].append(time)
+
+                if checkpoint and interval and (current + 1) % interval == 0:
+                    save_progress(checkpoint, state, store, graphs)
+
+            if checkpoint:
+                save_progress(checkpoint, state, store, graphs)
+
+            if persistence is not None:
+                if metrics:
+                    log.info("Calculating %s for the consensus network...\n" % " and ".join(names[metric] for metric in metrics))
+                save_consensus(persistence, prefix, args, metrics)
+
+            if summary is not None:
+                log.info("Plotting summary...\n")
+                save_summary(collect_summary([summary]), prefix)
+
+            if averages is not None:
+                save_averages(averages, prefix)
+    finally:
+        if store is not None:
+            store.close()
+        if graphs is not None:
+            graphs.close()
+        for name in ("summary", "contacts"):
+            if state[name] is not None:
+                state[name].close()
+
+
+def save_progress(checkpoint, state, store=None, graphs=None):
+    # the ends of the store and graph archive are saved with the state, so
+    # that --resume and merge_shards.py only read the frames it covers
+    state["store_end"] = store.sync() if store is not None else None
+    state["graphs_end"] = graphs.sync() if graphs is not None else None
+
+    save_checkpoint(checkpoint, state)
+
+
+def new_state(traj_name, args, metrics, frames=None, checkpoint=None):
+    # frames is the (first, stop, total) range of frames of the run, as
+    # returned by frame_range - the state of a finished run over a range is
+    # what merge_shards.py combines. With a checkpoint, the summary and the
+    # contacts of every frame (for --consensus) are logged to
+    # <checkpoint>.summary and <checkpoint>.contacts.
+    return {
+        "kind": "network",
+        "settings": checkpoint_settings(traj_name, args, metrics),
+        "frames": frames,
+        "frame": (frames[0] if frames is not None else 0) - 1,
+        "times": [],
+        "failed": {},
+        "contacts": FrameLog("%s.contacts" % checkpoint) if args.consensus and checkpoint else None,
+        "summary": FrameLog("%s.summary" % checkpoint if checkpoint else None) if args.summary_plot else None,
+        "averages": FrameAverages(args.delta_normalization) if args.average else None,
+        "store_end": None,
+        "graphs_end": None
+    }
+
+
+def load_persistence(state):
+    # contact persistence of the frames completed so far
+    persistence = ContactPersistence()
+
+    if state["contacts"] is not None:
+        for num_nodes, edges in state["contacts"]:
+            persistence.add(num_nodes, edges)
+
+    return persistence
+
+
+def collect_summary(summaries):
+    # BC/avg L of every frame by metric, from the summary logs of one or more
+    # consecutive runs
+    summary = collections.defaultdict(list)
+
+    for frames in summaries:
+        for metric, time, values in frames:
+            summary[metric].append((time, values))
+
+    return summary
+
+
+def checkpoint_settings(traj_name, args, metrics):
+    # a run can only be resumed with the settings that the checkpoint was
+    # written with
+    names = ("step", "threshold", "ligands", "consensus", "min_occupancy", "average", "delta_normalization", "bc_approx", "seed",
+             "summary_plot", "no_frame_output", "store", "discard_graphs", "graph_archive", "frame_start", "frame_end", "shard")
+
+    settings = dict((name, getattr(args, name, None)) for name in names)
+    settings["trajectory"] = traj_name
+    settings["metrics"] = list(metrics)
+
+    return settings
+
+
+def resume_state(checkpoint, traj_name, args, metrics):
+    # loads the checkpoint of an earlier run and checks that the outputs of
+    # every frame it completed are present - returns None if there is no
+    # checkpoint (the run then starts from the first frame)
+    if not os.path.exists(checkpoint):
+        log.info("No checkpoint found (%s) - starting from the first frame\n" % checkpoint)
+        return None
+
+    state = load_checkpoint(checkpoint)
+
+    if state["settings"] != checkpoint_settings(traj_name, args, metrics):
+        log.error("The settings of this run do not match those of the checkpoint %s - run without --resume to start again.\n" % checkpoint)
+        sys.exit(1)
+
+    missing = find_missing_output(state, traj_name, args, metrics)
+    if missing is not None:
+        log.error("type=general:frame=%d:message=%s - run without --resume to recalculate all frames.\n" % (missing[0] + 1, missing[1]))
+        sys.exit(1)
+
+    log.info("Resuming after frame %d (%s)\n" % (state["frame"] + 1, checkpoint))
+
+    return state
+
+
+def find_missing_output(state, traj_name, args, metrics):
+    # returns (frame index, description) for the first completed frame with
+    # an output that is missing or empty (frames that failed are skipped)
+    traj_prefix = ".".join(traj_name.split(".")[:-1])
+    frames = state["frames"]
+    names = {"BC": ["bc"] + (["bc_err"] if args.bc_approx else []), "L": ["L", "avg_L"]}
 
-            prefix = "%s_%d" % (".".join(traj_name.split(".")[:-1]), frame.time[0])
+    stored = {}
+    if args.store and os.path.exists(args.store):
+        with ResultStore(args.store) as store:
+            stored = store.index
+
+    archived = None
+    if args.discard_graphs:
+        archive = args.graph_archive or "%s_graphs.mdg" % output_prefix(traj_name, frames)
+        archived = set()
+
+        if os.path.exists(archive):
+            with GraphArchive(archive) as graphs:
+                archived = set(graphs.index)
+
+    frame_output = not args.consensus and not args.no_frame_output
+
+    for current, time in enumerate(state["times"], frames[0] if frames is not None else 0):
+        failed = state["failed"].get(current, ())
+
+        if archived is not None and current not in archived and "contacts" not in failed and "graph" not in failed:
+            return current, "Network missing from the graph archive"
+
+        for metric in metrics if frame_output else ():
+            if metric in failed:
+                continue
+
+            for name in names[metric]:
+                if args.store:
+                    if current not in stored.get(name, {}):
+                        return current, "%s missing from %s" % (name, args.store)
+                else:
+                    path = "%s_%d_%s.dat" % (traj_prefix, time, name)
+                    if not os.path.exists(path) or not os.path.getsize(path):
+                        return current, "%s is missing or empty" % path
+
+    return None
+
+
+def save_results(current, time, num_nodes, edges, results, traj_name, args, metrics, store=None, plots=None, summary=None, graphs=None, averages=None):
+    # returns the names of the outputs that could not be saved for the frame
+    prefix = "%s_%d" % (".".join(traj_name.split(".")[:-1]), time)
+    failed = []
+
+    if graphs is not None and edges is not None:
+        try:
+            graphs.append(current, time, num_nodes, edges)
+        except Exception as ex:
+            failed.append("graph")
+            log.error("type=general:frame=%d:message=%s\n" % (current + 1, str(ex)))
+
+    for metric in metrics:
+        try:
+            if isinstance(results[metric], Exception):
+                raise results[metric]
+
+            # BC and avg L per node - per-frame outputs are optional when
+            # only the averages are needed
+            if metric == "BC" and args.no_frame_output:
+                values = results[metric]
+            elif metric == "BC":
+                values = save_BC(results[metric], prefix, args.generate_plots, results.get("BC error"), store, (current, time), plots)
+            elif metric == "L" and args.no_frame_output:
+                values = average_shortest_paths(results[metric])
+            elif metric == "L":
+                values = save_shortest_path(results[metric], prefix, args.generate_plots, args.xmgrace, store, (current, time), plots)
+
+            if summary is not None:
+                summary.append((metric, time, values))
+
+            if averages is not None:
+                averages.add(metric, values)
 
-            pg = construct_graph(frame, args.ligands, prefix, args.threshold, args.discard_graphs)
-            
-            calc_shortest_path(pg, prefix, args.generate_plots, args.xmgrace)
-            
         except nx.exception.NetworkXNoPath as nex:
+            failed.append(metric)
             log.error("type=orphan_node:frame=%d:message=%s. Try increasing the threshold.\n" % (current + 1, str(nex)))
 
         except Exception as ex:
+            failed.append(metric)
             log.error("type=general:frame=%d:message=%s\n" % (current + 1, str(ex)))
 
+    return failed
+
+
+def save_summary(summary, prefix):
+    # one figure per metric with the BC/avg L of every frame
+    for metric, frames in summary.items():
+        times = [time for time, _ in frames]
+        matrix = np.vstack([values for _, values in frames])
+
+        plot_summary(matrix, "%s_%s_summary.png" % (prefix, metric), "%s %s" % (prefix, metric), times, y_label=metric)
+
+
+def save_averages(averages, prefix):
+    # written as avg_network.py would for the same frames, e.g.
+    # <trajectory>_BC_avg.dat and <trajectory>_delta_L_std_dev.dat
+    for name in averages.names():
+        mean, std = averages.result(name)
+
+        np.savetxt("%s_%s_avg.dat" % (prefix, name), mean)
+        np.savetxt("%s_%s_std_dev.dat" % (prefix, name), std)
+
+
+def save_consensus(persistence, prefix, args, metrics):
+    # writes the occupancy of every contact (<trajectory>_consensus_edges.dat
+    # - node i, node j, fraction of frames) and the metrics of the network of
+    # contacts present in at least --min-occupancy of the frames. Path lengths
+    # in this network are 1/occupancy, so persistent contacts are preferred.
+    prefix = "%s_consensus" % prefix
+
+    if not persistence.frames:
+        log.error("type=general:message=No frames were read - the consensus network cannot be built\n")
+        return
+
+    edges, occupancy = persistence.occupancy()
+    np.savetxt("%s_edges.dat" % prefix, np.column_stack((edges, occupancy)), fmt="%d %d %.6f")
+
+    keep = occupancy >= args.min_occupancy
+    edges, lengths = edges[keep], 1. / occupancy[keep]
+    num_nodes = persistence.num_nodes
+
+    log.info("Consensus network: %d of %d contacts are present in at least %g of the %d frames\n" % (len(edges), len(keep), args.min_occupancy, persistence.frames))
+
+    for metric in metrics:
+        try:
+            if metric == "BC":
+                save_BC(weighted_betweenness(num_nodes, edges, lengths), prefix, args.generate_plots)
+            elif metric == "L":
+                save_shortest_path(weighted_shortest_path_matrix(num_nodes, edges, lengths), prefix, args.generate_plots, args.xmgrace)
+
+        except nx.exception.NetworkXNoPath as nex:
+            log.error("type=orphan_node:message=%s. Try increasing the threshold or decreasing --min-occupancy.\n" % str(nex))
+
+        except Exception as ex:
+            log.error("type=general:message=%s\n" % str(ex))
+
+
+def calc_shortest_paths(traj, traj_name, total_frames, args):
+    calc_networks(traj, traj_name, total_frames, args, ("L",))
+
 
 def calc_shortest_path(protein_graph, prefix, generate_plots=True, xmgrace=False):
+    edges = np.array(list(protein_graph.edges()), dtype=np.intp)
+    dj_path_matrix = shortest_path_matrix(len(protein_graph.nodes()), edges)
+    save_shortest_path(dj_path_matrix, prefix, generate_plots, xmgrace)
+
+    return dj_path_matrix
 
-    num_nodes = len(protein_graph.nodes())
-    nodes_axis = range(1, num_nodes + 1)
 
-    path_dict = dict(nx.all_pairs_shortest_path_length(protein_graph))
-    dj_path_matrix = np.zeros((num_nodes, num_nodes))
+def shortest_path_matrix(num_nodes, edges, network=None):
+    # with --incremental, the network keeps the previous frame's lengths and
+    # only updates them for the edges that changed
+    if network is not None:
+        dj_path_matrix = network.shortest_paths()
+    else:
+        indptr, indices = adjacency(num_nodes, edges)
+        dj_path_matrix = shortest_path_lengths(indptr, indices)
 
-    for i in range(num_nodes):
-        for j in range(num_nodes):
-            try:
-                dj_path_matrix[i,j] = path_dict[i][j]
-            except KeyError as ke:
-                raise nx.exception.NetworkXNoPath("\nERROR::type=orphan_node:message=No link between %d and %d:exception=%s\n" % (i, j, str(ke)))
+    # unreachable pairs are marked with -1
+    unreachable = dj_path_matrix < 0
+    if unreachable.any():
+        i, j = np.argwhere(unreachable)[0]
+        raise nx.exception.NetworkXNoPath("\nERROR::type=orphan_node:message=No link between %d and %d\n" % (i, j))
+
+    return dj_path_matrix
+
+
+def weighted_shortest_path_matrix(num_nodes, edges, lengths):
+    dj_path_matrix = weighted_shortest_path_lengths(num_nodes, edges, lengths)
+
+    unreachable = np.isinf(dj_path_matrix)
+    if unreachable.any():
+        i, j = np.argwhere(unreachable)[0]
+        raise nx.exception.NetworkXNoPath("\nERROR::type=orphan_node:message=No link between %d and %d\n" % (i, j))
+
+    return dj_path_matrix
+
+
+def save_matrix(matrix, name, prefix, store=None, frame=None):
+    # writes <prefix>_<name>.dat or, with --store, appends the matrix to the
+    # result store as dataset <name> for the (index, time) frame
+    if store is not None:
+        store.append(frame[0], frame[1], name, matrix)
+    else:
+        np.savetxt("%s_%s.dat" % (prefix, name), matrix)
+
+
+def save_shortest_path(dj_path_matrix, prefix, generate_plots=True, xmgrace=False, store=None, frame=None, plots=None):
+    num_nodes = dj_path_matrix.shape[0]
 
-    np.savetxt("%s_L.dat" % prefix, dj_path_matrix)
-    avg_L_per_node = np.sum(dj_path_matrix, axis=0)/(num_nodes - 1)
+    save_matrix(dj_path_matrix, "L", prefix, store, frame)
+    avg_L_per_node = average_shortest_paths(dj_path_matrix)
 
     if generate_plots:
-        plt.plot(nodes_axis, avg_L_per_node)
-        plt.title("%s L" % prefix, fontsize=18)
-        plt.xlabel('Node Indices', fontsize=16)
-        plt.ylabel('L', fontsize=16)
-        plt.savefig("%s_L.png" % prefix, dpi=300, bbox_inches='tight',format="png")
-        plt.close()
-
-    avg_L_per_node = avg_L_per_node.reshape(1, num_nodes)
-    np.savetxt("%s_avg_L.dat" % prefix, avg_L_per_node)
+        (plots or PlotQueue()).submit(plot_nodes, avg_L_per_node, "%s_L.png" % prefix, "%s L" % prefix, y_label="L")
+
+    save_matrix(avg_L_per_node if store is not None else avg_L_per_node.reshape(1, num_nodes), "avg_L", prefix, store, frame)
     # if xmgrace:
     #     dat2xmgrace(avg_L_per_node, prefix, "L", traj=traj)
 
-    return dj_path_matrix
+    return avg_L_per_node
+
+
+def average_shortest_paths(dj_path_matrix):
+    return np.sum(dj_path_matrix, axis=0)/(dj_path_matrix.shape[0] - 1)
 
 
 def calc_centralities(traj, traj_name, total_frames, args):
-    log.info("Calculating betweenness centralities...\n")
-    for current, frame in enumerate(traj):
-        try:
-            if total_frames:
-                log.info("Progress: %d/%d\r" % (current + 1, total_frames))
-            else:
-                log.info("Progress: %d frames completed\r" % (current + 1))
+    calc_networks(traj, traj_name, total_frames, args, ("BC",))
 
-            prefix = "%s_%d" % (".".join(traj_name.split(".")[:-1]), frame.time[0])
 
-            pg = construct_graph(frame, args.ligands, prefix, args.threshold, args.discard_graphs)
+def calc_BC(protein_graph, prefix, generate_plots=True, backend="networkx"):
+    edges = np.array(list(protein_graph.edges()), dtype=np.intp)
+    bc = betweenness(len(protein_graph.nodes()), edges, backend)
+    save_BC(bc, prefix, generate_plots)
 
-            calc_BC(pg, prefix, args.generate_plots)
+    return bc.reshape(1, len(bc))
 
-        except Exception as ex:
-            log.error("type=general:frame=%d:message=%s\n" % (current + 1, str(ex)))
 
+def betweenness(num_nodes, edges, backend="networkx"):
+    if backend == "csr":
+        indptr, indices = adjacency(num_nodes, edges)
+        return betweenness_centrality(indptr, indices)
+
+    bc = nx.betweenness_centrality(build_graph(num_nodes, edges), normalized=False)
+    return np.asarray([bc[node] for node in range(num_nodes)])
+
+
+def batch_betweenness(num_nodes, edges_list):
+    # BC of several networks with the same nodes, one row per network
+    indptr, indices = batch_adjacency(num_nodes, edges_list)
+    return betweenness_centrality(indptr, indices, num_nodes).reshape(len(edges_list), num_nodes)
+
+
+def weighted_betweenness(num_nodes, edges, lengths):
+    protein_graph = build_graph(num_nodes, np.zeros((0, 2), dtype=np.intp))
+    protein_graph.add_weighted_edges_from(zip(edges[:, 0].tolist(), edges[:, 1].tolist(), lengths.tolist()), weight="length")
+
+    bc = nx.betweenness_centrality(protein_graph, normalized=False, weight="length")
+    return np.asarray([bc[node] for node in range(num_nodes)])
 
-def calc_BC(protein_graph, prefix, generate_plots=True):
-    bc = nx.betweenness_centrality(protein_graph, normalized=False)
-    bc = np.asarray(list(bc.values()))
 
-    num_nodes = len(protein_graph.nodes())
-    nodes_axis = range(1, num_nodes + 1)
+def save_BC(bc, prefix, generate_plots=True, error=None, store=None, frame=None, plots=None):
+    num_nodes = len(bc)
 
     if generate_plots:
-        plt.plot(nodes_axis, bc)
-        plt.title("%s BC" % prefix, fontsize=18)
-        plt.xlabel('Node Indices', fontsize=16)
-        plt.ylabel('BC', fontsize=16)
-        plt.savefig("%s_BC.png" % prefix, dpi=300, bbox_inches='tight',format="png")
-        plt.close()
+        (plots or PlotQueue()).submit(plot_nodes, bc, "%s_BC.png" % prefix, "%s BC" % prefix, y_label="BC", error=error)
 
-    bc = bc.reshape(1, num_nodes)
-    np.savetxt("%s_bc.dat" % prefix, bc)
+    # the .dat files hold a single row, the store keeps the plain vectors
+    save_matrix(bc if store is not None else bc.reshape(1, num_nodes), "bc", prefix, store, frame)
+
+    # standard error of approximate BC (--bc-approx)
+    if error is not None:
+        save_matrix(error if store is not None else error.reshape(1, num_nodes), "bc_err", prefix, store, frame)
 
     return bc
 
 
 def main(args):
-    if not args.calc_BC and not args.calc_L:
+    if not args.calc_BC and not args.calc_L and not args.consensus:
         log.error("At least one of the --calc-BC or --calc-L flags must be set.")
         sys.exit(1)
 
+    if args.bc_approx is not None and args.bc_approx < 2:
+        log.error("--bc-approx needs at least 2 source nodes to estimate BC and its error.\n")
+        sys.exit(1)
+
+    if args.incremental and args.workers > 1:
+        log.error("--incremental updates each frame's network from the previous one and cannot be combined with --workers.\n")
+        sys.exit(1)
+
+    if args.consensus and (args.average or args.summary_plot):
+        log.error("--consensus calculates BC/L on a single network and cannot be combined with --average or --summary-plot, which cover every frame.\n")
+        sys.exit(1)
+
     global traj
     traj_name = os.path.basename(args.trajectory)
-    traj, total_frames = load_trajectory(args.trajectory, args.topology, args.step, args.lazy_load)
 
+    metrics = []
     if args.calc_BC:
-        calc_centralities(traj, traj_name, total_frames, args)
-
+        metrics.append("BC")
     if args.calc_L:
-        calc_shortest_paths(traj, traj_name, total_frames, args)
+        metrics.append("L")
+
+    # a run over part of the trajectory only reads its own frames - the
+    # checkpoints of the shards of a trajectory are combined by
+    # merge_shards.py into the outputs of a single run
+    frames = frame_range(args.trajectory, args.step, args.frame_start, args.frame_end, args.shard)
+    if frames is not None:
+        log.info("Processing frames %d to %d of %d\n" % (frames[0] + 1, frames[1], frames[2]))
+
+    # with --resume, the frames completed by the previous run are skipped
+    checkpoint = args.checkpoint or "%s.checkpoint" % output_prefix(traj_name, frames)
+    state = resume_state(checkpoint, traj_name, args, metrics) if args.resume else None
+    start = state["frame"] + 1 if state is not None else (frames[0] if frames is not None else 0)
+    n_frames = frames[1] - start if frames is not None else None
+
+    # the nodes are selected once from the topology and only their
+    # co-ordinates are read from the trajectory
+    atoms, _ = select_nodes(load_topology(args.trajectory, args.topology), get_atom_filter(args.ligands))
+    cache = CoordinateCache(args.cache_dir, int(args.cache_size * 2**30)) if args.cache_dir else None
+    traj, total_frames = load_trajectory(args.trajectory, args.topology, args.step, args.lazy_load, args.chunk_size, atoms, start, n_frames, cache, args.prefetch)
+
+    if total_frames is not None:
+        total_frames += start
+
+    # the final state of a run over a range is always saved, for merging
+    save = args.checkpoint_interval or frames is not None
+    calc_networks(traj, traj_name, total_frames, args, metrics, state, checkpoint if save else None, frames)
 
 
 log = Logger()
@@ -179,10 +704,37 @@ if __name__ == "__main__":
     parser.add_argument("--threshold", help="Maximum distance threshold in Angstroms when constructing graph (default: 6.7)", default=6.7, type=float)
     parser.add_argument("--step", help="Size of step when iterating through trajectory frames", default=1, type=int)
     parser.add_argument("--generate-plots", help="Generate figures/plots", action='store_true', default=False)
+    parser.add_argument("--plot-workers", help="Number of background processes used to render the --generate-plots figures while the calculation continues (default: 0 - render in the main process)", default=0, type=int)
+    parser.add_argument("--summary-plot", help="Plot the BC/L of all frames in a single figure (<trajectory>_BC_summary.png/<trajectory>_L_summary.png)", action='store_true', default=False)
     parser.add_argument("--calc-L", help="Calculate delta L", action='store_true', default=False)
     parser.add_argument("--calc-BC", help="Calculate delta BC", action='store_true', default=False)
-    parser.add_argument("--discard-graphs", help="Discard calculated networks when complete (default: save networks in graphml and gml formats)", action='store_false', default=True)
+    parser.add_argument("--discard-graphs", help="Discard calculated networks when complete (default: save the networks of all frames to a graph archive)", action='store_false', default=True)
+    parser.add_argument("--graph-archive", help="File the networks are saved to (default: <trajectory>_graphs.mdg) - use convert_graphs.py to export frames in gml/graphml format", default=None)
+    parser.add_argument("--compress-graphs", help="Compress the networks in the graph archive", action='store_true', default=False)
     parser.add_argument("--lazy-load", help="Read frames as they are needed (memory efficient - use for big trajectories)", action='store_true', default=False)
+    parser.add_argument("--cache-dir", help="Directory of a co-ordinate cache shared by the MD-TASK tools - the co-ordinates of the selected atoms are read from the trajectory once and memory-mapped from the cache by later runs (default: no cache)", default=None)
+    parser.add_argument("--cache-size", help="Maximum size of the --cache-dir cache in GB - the least recently used trajectories are removed (default: 10)", default=10, type=float)
+    parser.add_argument("--consensus", help="Build a single consensus network weighted by how often each contact is present over the trajectory (<trajectory>_consensus_edges.dat) and calculate BC/L on it instead of for every frame", action='store_true', default=False)
+    parser.add_argument("--min-occupancy", help="Fraction of frames a contact must be present in to be part of the --consensus network (default: 0.5)", default=0.5, type=float)
+    parser.add_argument("--average", help="Keep a running mean and standard deviation of the BC/avg L of all frames and write them when complete (<trajectory>_BC_avg.dat, <trajectory>_BC_std_dev.dat, ... - as avg_network.py)", action='store_true', default=False)
+    parser.add_argument("--delta-normalization", help="With --average, also average the change in BC/avg L of the other frames from the first frame, normalized as in calc_delta.py", choices=["none", "standard", "plusone", "nonzero"], default=None)
+    parser.add_argument("--no-frame-output", help="Do not write the BC/L files (or plots) of each frame - use with --average or --summary-plot", action='store_true', default=False)
+    parser.add_argument("--checkpoint", help="Checkpoint file recording the progress of the run (default: <trajectory>.checkpoint)", default=None)
+    parser.add_argument("--checkpoint-interval", help="Number of frames between checkpoints, needed to --resume an interrupted run (default: 0 - no checkpoints)", default=0, type=int)
+    parser.add_argument("--frame-start", help="Index of the first trajectory frame to process (default: 0)", default=None, type=int)
+    parser.add_argument("--frame-end", help="Index of the trajectory frame to stop before (default: the end of the trajectory)", default=None, type=int)
+    parser.add_argument("--shard", help="Only process part i of n equal parts of the frames (e.g. 2/4) - combine the shards with merge_shards.py", default=None, type=parse_shard)
+    parser.add_argument("--resume", help="Continue an interrupted run from its checkpoint - the outputs of the frames it completed are checked, not recalculated", action='store_true', default=False)
+    parser.add_argument("--store", help="Save the results for all frames to this single binary result store instead of per-frame .dat files (read with <store>:<dataset>[:<frame>], e.g. wt.store:bc)", default=None)
+    parser.add_argument("--chunk-size", help="Number of frames read from the trajectory at a time (default: 100)", default=100, type=int)
+    parser.add_argument("--prefetch", help="Number of chunks read ahead in a background thread while the current chunk is processed, with --lazy-load or when adding the trajectory to the --cache-dir cache (default: 0 - read chunks when they are needed)", default=0, type=int)
+    parser.add_argument("--batch-contacts", help="Find the contacts for a whole chunk of frames at once using vectorized distance calculations (fast for small to medium sized networks)", action='store_true', default=False)
+    parser.add_argument("--bc-backend", help="Implementation used to calculate BC - networkx or csr (Brandes' algorithm on sparse arrays, much faster for large networks - with --batch-contacts, the BC of a whole chunk of frames is calculated at once) (default: networkx)", choices=["networkx", "csr"], default="networkx")
+    parser.add_argument("--bc-approx", help="Estimate BC from a sample of this many source nodes instead of calculating it exactly - the standard error of the estimate is saved to <prefix>_bc_err.dat", default=None, type=int)
+    parser.add_argument("--seed", help="Random seed used to sample source nodes for --bc-approx (default: random)", default=None, type=int)
+    parser.add_argument("--incremental", help="Update the shortest paths of each frame from the previous frame's network when only a few contacts change (BC is reused when no contacts change)", action='store_true', default=False)
+    parser.add_argument("--max-edge-changes", help="Maximum number of changed contacts for which --incremental updates the previous frame rather than recalculating (default: %d)" % MAX_EDGE_CHANGES, default=MAX_EDGE_CHANGES, type=int)
+    parser.add_argument("--workers", help="Number of processes used to calculate the networks of different frames in parallel (default: 1)", default=1, type=int)
     parser.add_argument("--xmgrace", help="Generate xmgrace compatible format", action='store_true', default=False)
 
     CLI(parser, main, log)
@@ -7,12 +7,11 @@
 # Author: David Brown
 # Date: 17-11-2016
 
-import numpy as np
-
 from lib.cli import CLI
 from lib.utils import Logger
+from lib.store import load_data, parse_spec
 
-import argparse, matplotlib
+import sys, argparse, matplotlib
 
 matplotlib.use('Agg')
 import matplotlib.pyplot as plt
@@ -60,9 +59,25 @@ def plot_comparison(reference, alternative, reference_label, alternative_label,
     plt.close()
 
 
+def load_network(spec):
+    # a stored dataset without a frame index (all frames) is compared by its
+    # average - any other input must hold a single value per node
+    data = load_data(spec)
+    parsed = parse_spec(spec)
+
+    if data.ndim > 1 and parsed is not None and parsed[2] is None:
+        data = data.mean(axis=0)
+
+    if data.ndim != 1:
+        log.error("%s must hold a single value per node (found an array of shape %s)\n" % (spec, "x".join(str(size) for size in data.shape)))
+        sys.exit(1)
+
+    return data
+
+
 def main(args):
-    reference = np.loadtxt(args.reference)
-    alternative = np.loadtxt(args.alternative)
+    reference = load_network(args.reference)
+    alternative = load_network(args.alternative)
 
     y_label = args.y_label
     if not y_label:
@@ -80,8 +95,8 @@ log = Logger()
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
 
-    parser.add_argument("--reference", help="The reference network (.dat)")
-    parser.add_argument("--alternative", help="The alternative network (.dat)")
+    parser.add_argument("--reference", help="The reference network (.dat or a result store dataset, e.g. wt.store:bc)")
+    parser.add_argument("--alternative", help="The alternative network (.dat or a result store dataset, e.g. mutant.store:bc)")
     parser.add_argument("--prefix", help="Prefix for output files")
     parser.add_argument("--reference-label", help="Label to display on graphs for reference network", default="")
     parser.add_argument("--alternative-label", help="Label to display on graphs for alternative network", default="")
@@ -8,13 +8,14 @@ import sys
 import argparse
 from datetime import datetime
 import numpy as np
-import mdtraj as md
 import networkx as nx
 import pandas as pd
 import matplotlib
 matplotlib.use('Agg')
 from matplotlib import pyplot as plt
 from lib.utils import format_seconds
+from lib.trajectory import load_trajectory, load_topology, select_nodes, frame_range, parse_shard, CoordinateIterator, CoordinateCache, distance_block, periodic_boxes
+from lib.checkpoint import save_checkpoint
 
 __author__ = "Olivier Sheik Amamuddy"
 __copyright__ = "Copyright 2019, Research Unit in Bioinformatics"
@@ -66,11 +67,6 @@ def main(args):
     topology = args.topology
     cutoff = args.threshold / 10
     chain = args.chain
-    node_size = args.nodesize
-    node_fontsize = args.nodefontsize
-    edgewidth_factor = args.edgewidthfactor
-    edgelabel_fontsize = args.edgelabelfontsize
-    discardplot = args.discard_graphs
 
     if args.residue is not None:
         residue = args.residue.upper()
@@ -81,53 +77,65 @@ def main(args):
     prefix = residue
     chain_chars = "ABCDEFGHIJKLMNOPQRSTUVWXYZ"
 
+    # runs over a range of frames (--frame-start/--frame-end/--shard) tag
+    # their outputs with it and save their contact counts for merge_shards.py
+    frames = frame_range(traj_path, args.step, args.frame_start, args.frame_end, args.shard)
+    skip, n_frames = 0, None
+    if frames is not None:
+        prefix = "%s_frames%d-%d" % (residue, frames[0], frames[1])
+        skip, n_frames = frames[0], frames[1] - frames[0]
+        log("Processing frames %d to %d of %d\n" % (frames[0] + 1, frames[1], frames[2]))
+
     log("Loading trajectory...\n")
 
+    # the CB (CA for glycine) atoms are selected once and only their
+    # co-ordinates are read from the trajectory (or the co-ordinate cache)
+    cache = None
+    if args.cache_dir is not None:
+        cache = CoordinateCache(args.cache_dir, int(args.cache_size * 2**30))
+
     try:
-        traj = md.load(traj_path, top=topology)[::args.step]
+        atom_indices, nodes = select_nodes(load_topology(traj_path, topology))
+        traj = load_trajectory(traj_path, topology, args.step, atom_indices=atom_indices, skip=skip, n_frames=n_frames, cache=cache)[0]
     except TypeError as ex:
         print(ex)
         sys.exit()
 
-    atom_indices = [atom.index for atom in traj.topology.atoms if
-                    ((atom.name == "CB" and atom.residue.name != "GLY") or \
-        (atom.name == "CA" and atom.residue.name == "GLY"))]
-    traj = traj.atom_slice(atom_indices, inplace=True)
-    atom_indices = [atom.index for atom in traj.topology.atoms]
-    residues = list(map(lambda x: str(x), traj.top.residues))
+    atom_indices = list(range(len(nodes)))
+    residues = ["{}{}".format(name, resid) for name, resid in zip(nodes["name"], nodes["resSeq"].tolist())]
+    chains = [chain_chars[index] for index in nodes["chain"]]
     if residue not in residues:
         log("ERROR: Residue {} not found.\n".format(residue))
         sys.exit()
     nframes = traj.n_frames
     center = "{}.{}".format(residue, chain)
-    contacts = {}
 
     log("Calculating weighted contacts around %s (chain %s)...\n" % (residue, chain))
 
-    for frame in traj:
-        for aaidx, atom1_idx in enumerate(atom_indices):
-            if residues[aaidx] == residue:
-                atom1 = list(frame.top.atoms)[atom1_idx]
-                atom1_chain = chain_chars[atom1.residue.chain.index]
-                atom1_resname = atom1.residue.name
-                atom1_resid = atom1.residue.resSeq
-                if atom1_chain == chain:
-                    for atom2_idx in atom_indices:
-                        if atom1_idx != atom2_idx:
-                            distance = np.linalg.norm(frame.xyz[0, atom1_idx] \
-                                                      - frame.xyz[0, atom2_idx])
-                            if distance < cutoff:
-                                atom2 = list(frame.top.atoms)[atom2_idx]
-                                atom2_chain = chain_chars[atom2.residue.chain.index]
-                                atom2_resname = atom2.residue.name
-                                atom2_resid = atom2.residue.resSeq
-                                edge = ("{}{}.{}".format(atom1_resname, atom1_resid, atom1_chain),
-                                        "{}{}.{}".format(atom2_resname, atom2_resid, atom2_chain))
-                                if edge not in contacts.keys():
-                                    contacts[edge] = 1
-                                else:
-                                    contacts[edge] += 1
-                    break
+    # the centre is the first node of the residue in the chain - its
+    # distances to every node are computed a chunk of frames at a time
+    centers = [index for index in atom_indices if residues[index] == residue and chains[index] == chain]
+    counts = np.zeros(len(atom_indices), dtype=np.int64)
+    first_seen = np.zeros(len(atom_indices), dtype=np.int64)
+    offset = 0
+
+    for xyz, _, boxes in CoordinateIterator(traj).chunks():
+        if centers:
+            hits = distance_block(xyz, [centers[0]], box=periodic_boxes(boxes, cutoff))[:, 0] < cutoff
+            hits[:, centers[0]] = False
+
+            seen = hits.any(axis=0) & (counts == 0)
+            first_seen[seen] = offset + np.argmax(hits[:, seen], axis=0)
+            counts += hits.sum(axis=0)
+
+        offset += len(xyz)
+
+    # contacts are listed in the order they are first seen, as frame by frame
+    contacts = {}
+    found = np.nonzero(counts)[0]
+    for atom2_idx in found[np.argsort(first_seen[found], kind="stable")]:
+        edge = ("{}.{}".format(residues[centers[0]], chain), "{}.{}".format(residues[atom2_idx], chains[atom2_idx]))
+        contacts[edge] = int(counts[atom2_idx])
 
     if args.ocsv is not None:
         csv_file = args.ocsv
@@ -139,6 +147,26 @@ def main(args):
     else:
         contact_map = "%s_chain%s_contact_map.pdf" % (prefix, chain)
 
+    if frames is not None:
+        save_checkpoint("%s_chain%s.partial" % (prefix, chain), {
+            "kind": "contacts", "frames": frames, "residue": residue, "chain": chain,
+            "contacts": contacts, "nframes": nframes,
+            "settings": dict((name, getattr(args, name)) for name in ("discard_graphs", "nodesize", "nodefontsize", "edgewidthfactor", "edgelabelfontsize"))
+        })
+
+    save_contact_map(contacts, nframes, center, csv_file, contact_map, args)
+
+
+def save_contact_map(contacts, nframes, center, csv_file, contact_map, args):
+    """
+    Writes the contact map and CSV file of the contacts counted over nframes
+    """
+    discardplot = args.discard_graphs
+    node_size = args.nodesize
+    node_fontsize = args.nodefontsize
+    edgewidth_factor = args.edgewidthfactor
+    edgelabel_fontsize = args.edgelabelfontsize
+
     log("Generating contact map: %s...\n" % contact_map)
 
     _ = nx.Graph()
@@ -197,6 +225,27 @@ def parse_args():
                         default=1, type=int)
     parser.add_argument("--chain", help="Chain ID to be matched (default: A)",
                         default="A")
+    parser.add_argument("--cache-dir",
+                        help="Directory of a co-ordinate cache shared by the \
+                        MD-TASK tools - the co-ordinates of the selected atoms \
+                        are read from the trajectory once and memory-mapped \
+                        from the cache by later runs (default: no cache)",
+                        default=None)
+    parser.add_argument("--cache-size",
+                        help="Maximum size of the --cache-dir cache in GB - the \
+                        least recently used trajectories are removed (default: 10)",
+                        default=10, type=float)
+    parser.add_argument("--frame-start",
+                        help="Index of the first trajectory frame to process (default: 0)",
+                        default=None, type=int)
+    parser.add_argument("--frame-end",
+                        help="Index of the trajectory frame to stop before \
+                        (default: the end of the trajectory)",
+                        default=None, type=int)
+    parser.add_argument("--shard",
+                        help="Only process part i of n equal parts of the frames \
+                        (e.g. 2/4) - combine the shards with merge_shards.py",
+                        default=None, type=parse_shard)
     parser.add_argument("--discard-graphs",
                         help="Suppress plotting. Only produce the CSV contact file",
                         action='store_true')
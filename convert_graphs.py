@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+#
+# Export networks saved in a graph archive by calc_network.py in gml and/or
+# graphml format
+#
+# Script distributed under GNU GPL 3.0
+
+from lib.cli import CLI
+from lib.utils import Logger
+from lib.graphs import GraphArchive
+from calc_network import build_graph, output_prefix
+
+import networkx as nx
+
+import os, argparse
+
+
+def main(args):
+    prefix = args.prefix
+    if prefix is None:
+        prefix = output_prefix(os.path.basename(args.archive))
+        if prefix.endswith("_graphs"):
+            prefix = prefix[:-len("_graphs")]
+
+    with GraphArchive(args.archive) as archive:
+        frames = archive.frames() if not args.frames else args.frames
+
+        for i, frame in enumerate(frames):
+            log.info("Converting %d/%d\r" % (i + 1, len(frames)))
+
+            if frame not in archive.index:
+                log.error("type=general:frame=%d:message=Frame not found in %s\n" % (frame, args.archive))
+                continue
+
+            num_nodes, edges = archive.read(frame)
+            protein_graph = build_graph(num_nodes, edges)
+
+            # named as the files previously written by calc_network.py
+            name = "%s_%d_graph" % (prefix, archive.time(frame))
+
+            if "gml" in args.formats:
+                nx.write_gml(protein_graph, "%s.gml" % name)
+            if "graphml" in args.formats:
+                nx.write_graphml(protein_graph, "%s.graphml" % name)
+
+    log.info("\n")
+
+
+log = Logger()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("archive", help="Graph archive saved by calc_network.py (<trajectory>_graphs.mdg)")
+    parser.add_argument("--frames", help="Indices of the frames to export (default: all frames)", nargs="*", type=int)
+    parser.add_argument("--formats", help="Formats to export (default: gml graphml)", nargs="*", choices=["gml", "graphml"], default=["gml", "graphml"])
+    parser.add_argument("--prefix", help="Prefix used to name outputs (default: the trajectory name)", default=None)
+
+    CLI(parser, main, log)
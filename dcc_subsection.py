@@ -1,11 +1,12 @@
 #Caroline Ross 14 December 2018
 #Plots a sub-section of dcc correlation
-#Input = the correlation.txt file from MD-TASK
+#Input = the correlation.txt (or correlation.npy) file from MD-TASK
 
 import matplotlib
 import matplotlib.pyplot as plt
 from matplotlib import cm as cm
 import numpy as np
+import os, sys
 
 
 def plot_map(correlation, title, output_prefix, x_labels, y_labels):
@@ -60,11 +61,15 @@ def print_correlation(correlation, output_prefix):
                 w.write('%s ' % str(correlation[r,c]))
             w.write('\n')
 
-#Reads in correlation.txt file:
+#Reads in the correlation matrix - a .npy file (from calc_correlation.py) is memory-mapped, so only the section is read from disk
+correlation_file = 'correlation.txt' #change file name here for use on different files (.txt or .npy)
 try:
-    f = open('correlation.txt', 'r') #change file name here for use on different file
-    correlation_values = f.readlines() #reads in all lines of correlation.txt
-    f.close() #close file
+    if correlation_file.endswith('.npy'):
+        correlation_values = np.load(correlation_file, mmap_mode='r')
+    else:
+        f = open(correlation_file, 'r')
+        correlation_values = f.readlines() #reads in all lines of the correlation file
+        f.close() #close file
 except IOError:
     print ('\n**************************************\nERROR!! FILE NOT FOUND:\n**************************************\n') #error if correlation.txt file not found
     sys.exit()
@@ -87,11 +92,14 @@ yatoms = proteinSectionB_end-proteinSectionB_start+1 #(sectionB will be columns
 
 Sub_cMatrix = np.zeros((xatoms, yatoms)) #set size of sub_matrix
 
-for i,x in enumerate(range(proteinSectionA_start-1,proteinSectionA_end)):
-    atom_specific_correlation = correlation_values[x].split()
-    for j, y in enumerate(range(proteinSectionB_start-1,proteinSectionB_end)):
-       x_yCorrelation = float(atom_specific_correlation[y].strip())
-       Sub_cMatrix[i, j] = x_yCorrelation
+if isinstance(correlation_values, np.ndarray):
+    Sub_cMatrix[:, :] = correlation_values[proteinSectionA_start-1:proteinSectionA_end, proteinSectionB_start-1:proteinSectionB_end]
+else:
+    for i,x in enumerate(range(proteinSectionA_start-1,proteinSectionA_end)):
+        atom_specific_correlation = correlation_values[x].split()
+        for j, y in enumerate(range(proteinSectionB_start-1,proteinSectionB_end)):
+           x_yCorrelation = float(atom_specific_correlation[y].strip())
+           Sub_cMatrix[i, j] = x_yCorrelation
 
 x_labels = []
 for i in range(proteinSectionB_start,proteinSectionB_end+1):
@@ -0,0 +1,87 @@
+import os, pickle
+
+from lib.utils import replace_file
+
+
+def save_checkpoint(path, state):
+    # the state is written to a temporary file that then replaces the
+    # previous checkpoint, so an interrupted write never leaves a broken one.
+    # The records of any FrameLog in the state are already on disk - only
+    # their length is saved.
+    for value in state.values():
+        if isinstance(value, FrameLog):
+            value.sync()
+
+    temp = "%s.tmp" % path
+
+    with open(temp, "wb") as f:
+        pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+        f.flush()
+        os.fsync(f.fileno())
+
+    replace_file(temp, path)
+
+
+def load_checkpoint(path):
+    with open(path, "rb") as f:
+        return pickle.load(f)
+
+
+class FrameLog(object):
+    # per-frame records (e.g. the BC of every frame for --summary-plot)
+    # appended to a file as they are produced, so that a checkpoint does not
+    # rewrite the records of all earlier frames. A checkpoint holds the path
+    # and the synced length of the log, and records written after it are
+    # dropped when the log is reopened (see calc_network.py --resume). Without
+    # a path, the records are kept in memory.
+
+    def __init__(self, path=None):
+        self.path = path
+        self.size = 0
+        self.records = []
+        self.file = open(path, "wb") if path is not None else None
+
+    def __getstate__(self):
+        return {"path": self.path, "size": self.size}
+
+    def __setstate__(self, state):
+        self.path, self.size = state["path"], state["size"]
+        self.records = []
+        self.file = None
+
+    def reopen(self):
+        # continues a log loaded from a checkpoint after its last synced record
+        self.file = open(self.path, "r+b")
+        self.file.truncate(self.size)
+        self.file.seek(self.size)
+
+    def append(self, record):
+        if self.path is None:
+            self.records.append(record)
+        else:
+            pickle.dump(record, self.file, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def sync(self):
+        if self.file is not None:
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.size = self.file.tell()
+
+    def close(self):
+        if self.file is not None:
+            self.sync()
+            self.file.close()
+            self.file = None
+
+    def __iter__(self):
+        if self.path is None:
+            for record in self.records:
+                yield record
+            return
+
+        if self.file is not None:
+            self.sync()
+
+        with open(self.path, "rb") as f:
+            while f.tell() < self.size:
+                yield pickle.load(f)
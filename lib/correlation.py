@@ -0,0 +1,276 @@
+import os
+import numpy as np
+
+
+def centred_displacements(coords, dtype=np.float64):
+    # the (T, N, 3) co-ordinates of N residues over T frames as an (N, 3T)
+    # matrix of their displacements from their mean positions - each row
+    # holds the displacement vectors of a residue in every frame, so dot
+    # products of rows are sums of dri.drj over the frames. The (N, 3) mean
+    # positions are returned as well.
+    coords = np.asarray(coords)
+    n_frames, n_residues = coords.shape[:2]
+
+    deltas = np.array(coords.transpose(1, 0, 2), dtype=dtype)
+    means = deltas.mean(axis=1)
+    deltas -= means[:, None, :]
+
+    return deltas.reshape(n_residues, n_frames * 3), means
+
+
+def open_matrix(path, size, dtype=np.float64):
+    # a size x size matrix memory-mapped from a new .npy file, for results
+    # that are written a tile at a time without being held in memory
+    return np.lib.format.open_memmap(path, mode="w+", dtype=dtype, shape=(size, size))
+
+
+def tiles(size, tile_size=None):
+    # (rows, columns) slices of the tiles on and above the diagonal of a
+    # size x size matrix, tile_size rows and columns at a time (default: the
+    # whole matrix)
+    tile_size = tile_size or size or 1
+    bounds = [(start, min(start + tile_size, size)) for start in range(0, size, tile_size)]
+
+    for i, rows in enumerate(bounds):
+        for cols in bounds[i:]:
+            yield slice(*rows), slice(*cols)
+
+
+def store_tile(matrix, rows, cols, tile):
+    # writes a tile (from tiles) and its mirror image below the diagonal -
+    # tiles on the diagonal take their upper triangle, so that the matrix is
+    # exactly symmetric
+    if rows == cols:
+        tile = np.triu(tile) + np.triu(tile, 1).T
+
+    matrix[rows, cols] = tile
+    matrix[cols, rows] = tile.T
+
+
+def cross_correlation(coords, dtype=np.float64, block_size=None, out=None):
+    # dynamic cross-correlation matrix of (T, N, 3) co-ordinates,
+    # C(i, j) = <dri.drj> / sqrt(<dri.dri><drj.drj>). The displacements are
+    # centred once and the matrix is calculated block_size x block_size tiles
+    # at a time (default: all at once) with matrix products - only the tiles
+    # on and above the diagonal are calculated and mirrored. With out (e.g.
+    # from open_matrix), the tiles are written into it instead of a new array.
+    # dtype=np.float32 halves the memory used at the cost of precision.
+    deltas = centred_displacements(coords, dtype)[0]
+    n_residues = len(deltas)
+
+    magnitude = np.sqrt(np.einsum("ij,ij->i", deltas, deltas))
+
+    correlation = np.empty((n_residues, n_residues), dtype=dtype) if out is None else out
+
+    for rows, cols in tiles(n_residues, block_size):
+        tile = deltas[rows].dot(deltas[cols].T)
+        tile /= magnitude[rows, None]
+        tile /= magnitude[None, cols]
+
+        store_tile(correlation, rows, cols, tile)
+
+    return correlation
+
+
+def reduce_matrix(matrix, max_size=1000):
+    # the matrix averaged over blocks of rows and columns so that neither
+    # dimension is larger than max_size, read a block of rows at a time -
+    # e.g. to plot a memory-mapped matrix. Smaller matrices are returned as
+    # they are.
+    n_rows, n_cols = matrix.shape
+    factor = max(1, -(-max(n_rows, n_cols) // max_size))
+    if factor == 1:
+        return np.asarray(matrix)
+
+    starts = np.arange(0, n_cols, factor)
+    widths = np.diff(np.append(starts, n_cols))
+    reduced = np.zeros((-(-n_rows // factor), len(starts)))
+
+    for i, start in enumerate(range(0, n_rows, factor)):
+        block = np.asarray(matrix[start:start + factor], dtype=np.float64)
+        reduced[i] = np.add.reduceat(block.sum(axis=0), starts) / (len(block) * widths)
+
+    return reduced
+
+
+class DCCAccumulator(object):
+    # running mean positions of N residues and the N x N co-moments of their
+    # displacements, sum(dri.drj), updated a chunk of frames at a time so that
+    # the frames never have to be held in memory together. Each chunk is
+    # centred on its own means and combined with the running sums as in
+    # RunningStats (Chan et al.), which avoids the cancellation of
+    # <ri.rj> - <ri>.<rj>. Accumulators of different frames can be merged,
+    # and frames that were added can be removed again (e.g. from a sliding
+    # window). The co-moments are updated block_size x block_size tiles at a
+    # time (default: the whole matrix at once) and, with a path, kept in a
+    # matrix memory-mapped from that .npy file (see open_matrix) rather than
+    # in memory.
+
+    def __init__(self, dtype=np.float64, block_size=None, path=None):
+        self.dtype = dtype
+        self.block_size = block_size
+        self.path = path
+
+        self.count = 0
+        self.mean = None
+        self.comoment = None
+
+        # the displacements of a chunk from summarise, instead of co-moments
+        self.deltas = None
+
+    def __getstate__(self):
+        # a memory-mapped matrix is saved as the path of its file
+        state = self.__dict__.copy()
+        if isinstance(self.comoment, np.memmap):
+            self.comoment.flush()
+            state["comoment"] = None
+
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self.comoment is None and self.path is not None and self.count:
+            self.comoment = np.load(self.path, mmap_mode="r")
+
+    def summarise(self, coords):
+        # an accumulator of (T, N, 3) co-ordinates on their own - its
+        # co-moments are only calculated (a tile at a time) when it is merged
+        chunk = DCCAccumulator(self.dtype)
+        chunk.deltas, chunk.mean = centred_displacements(coords, self.dtype)
+        chunk.count = len(coords)
+
+        return chunk
+
+    def comoment_tile(self, rows, cols):
+        if self.deltas is not None:
+            return self.deltas[rows].dot(self.deltas[cols].T)
+
+        return np.array(self.comoment[rows, cols], dtype=self.dtype)
+
+    def allocate(self, size):
+        if self.comoment is None or self.comoment.shape[0] != size:
+            if self.path is not None:
+                self.comoment = open_matrix(self.path, size, self.dtype)
+            else:
+                self.comoment = np.empty((size, size), dtype=self.dtype)
+
+    def add(self, coords):
+        # coords has the shape (T, N, 3)
+        if not len(coords):
+            return self
+
+        return self.merge(self.summarise(coords))
+
+    def remove(self, coords):
+        # coords must be frames that were added before
+        if not len(coords):
+            return self
+
+        return self.subtract(self.summarise(coords))
+
+    def update(self, other, sign, delta, scale):
+        # adds sign times the co-moments of other and scale * delta.delta^T
+        # for the (N, 3) delta between the means, a tile at a time
+        for rows, cols in tiles(len(self.mean), self.block_size):
+            tile = self.comoment_tile(rows, cols)
+            tile += sign * other.comoment_tile(rows, cols)
+            tile += delta[rows].dot(delta[cols].T) * scale
+
+            store_tile(self.comoment, rows, cols, tile)
+
+    def merge(self, other):
+        if not other.count:
+            return self
+
+        if not self.count:
+            self.count, self.mean = other.count, other.mean.copy()
+            self.allocate(len(self.mean))
+
+            for rows, cols in tiles(len(self.mean), self.block_size):
+                store_tile(self.comoment, rows, cols, other.comoment_tile(rows, cols))
+
+            return self
+
+        count = self.count + other.count
+        delta = other.mean - self.mean
+
+        self.update(other, 1, delta, float(self.count) * other.count / count)
+        self.mean = self.mean + delta * other.count / count
+        self.count = count
+
+        return self
+
+    def subtract(self, other):
+        # the inverse of merge - other holds a subset of the frames of this one
+        if not other.count:
+            return self
+
+        count = self.count - other.count
+        if count <= 0:
+            return self.reset()
+
+        mean = (self.mean * self.count - other.mean * other.count) / count
+        delta = other.mean - mean
+
+        self.update(other, -1, delta, -float(count) * other.count / self.count)
+        self.mean = mean
+        self.count = count
+
+        return self
+
+    def reset(self):
+        # drops all frames - the co-moment matrix is kept to be overwritten
+        self.count, self.mean = 0, None
+        return self
+
+    def discard(self):
+        # deletes the file of memory-mapped co-moments once the correlation
+        # has been written
+        self.comoment = None
+        if self.path is not None and os.path.exists(self.path):
+            os.remove(self.path)
+
+    def correlation(self, block_size=None, out=None):
+        # the correlation matrix, normalised block_size x block_size tiles at
+        # a time into out (e.g. from open_matrix) if it is given
+        magnitude = np.sqrt(np.diagonal(self.comoment).astype(np.float64))
+        correlation = np.empty(self.comoment.shape, dtype=self.dtype) if out is None else out
+
+        for rows, cols in tiles(len(magnitude), block_size or self.block_size):
+            tile = self.comoment_tile(rows, cols) / np.outer(magnitude[rows], magnitude[cols])
+
+            store_tile(correlation, rows, cols, tile)
+
+        return correlation
+
+
+def sliding_windows(chunks, window, step, dtype=np.float64, block_size=None, path=None):
+    # accumulators of every window of window consecutive frames, starting
+    # every step frames, from chunks of (T, N, 3) co-ordinates. Frames that
+    # leave a window are removed from the running sums and those that enter
+    # it are added, so each frame is only summed once on the way in (and once
+    # on the way out). The accumulator is updated in place between windows
+    # (block_size and path are passed on to DCCAccumulator).
+    accumulator = DCCAccumulator(dtype, block_size, path)
+    pending = np.zeros((0,), dtype=np.float32)
+    skip = 0
+
+    for xyz in chunks:
+        # frames between windows when step > window
+        dropped = min(skip, len(xyz))
+        xyz, skip = xyz[dropped:], skip - dropped
+
+        # frames from the start of the current window on
+        pending = np.array(xyz) if not len(pending) else np.concatenate((pending, xyz))
+
+        while len(pending) >= window:
+            accumulator.add(pending[accumulator.count:window])
+            yield accumulator
+
+            if step < window:
+                accumulator.remove(pending[:step])
+            else:
+                accumulator.reset()
+                skip = max(0, step - len(pending))
+
+            pending = pending[step:]
@@ -0,0 +1,157 @@
+import os, zlib
+import numpy as np
+
+
+MAGIC = b"MDTGRAPH\x01"
+
+RECORD = np.dtype([("frame", "<i8"), ("time", "<f8"), ("nodes", "<i8"), ("edges", "<i8"), ("size", "<i8"), ("width", "u1"), ("compressed", "u1")])
+
+
+def encode_edges(num_nodes, edges, compress=False):
+    # an edge (i, j) with i < j is stored as the key i * num_nodes + j. Keys
+    # are sorted and only the gaps between consecutive keys are written, in
+    # the smallest unsigned integer type that holds the largest gap.
+    edges = np.sort(np.asarray(edges, dtype=np.int64).reshape(-1, 2), axis=1)
+    keys = np.unique(edges[:, 0] * num_nodes + edges[:, 1])
+
+    gaps = np.diff(keys, prepend=0)
+    width = 1
+    while width < 8 and len(gaps) and gaps.max() >= 2**(8 * width):
+        width *= 2
+
+    payload = gaps.astype("<u%d" % width).tobytes()
+    if compress:
+        payload = zlib.compress(payload)
+
+    return payload, width, len(keys)
+
+
+def decode_edges(num_nodes, payload, width, num_edges, compressed=False):
+    if compressed:
+        payload = zlib.decompress(payload)
+
+    keys = np.cumsum(np.frombuffer(payload, dtype="<u%d" % width, count=num_edges), dtype=np.int64)
+
+    return np.column_stack(np.divmod(keys, num_nodes)).astype(np.intp)
+
+
+class GraphArchive(object):
+    # the contact networks of a whole trajectory in a single file - a short
+    # header followed by one record per frame (frame index, time, number of
+    # nodes and edges, then the encoded edges from encode_edges). Opening an
+    # archive only reads the record headers, so any frame can be loaded
+    # without parsing the others. As with ResultStore, an incomplete record
+    # at the end of the file is ignored and overwritten when appending, and
+    # mode "w" replaces any existing archive. As with ResultStore, a size
+    # ignores (or with mode "a" drops) the records after it.
+
+    def __init__(self, path, mode="r", compress=False, size=None):
+        self.path = path
+        self.mode = mode
+        self.compress = compress
+        self.size = size
+        self.index = {}
+        self.end = len(MAGIC)
+
+        exists = mode != "w" and os.path.exists(path) and os.path.getsize(path) > 0
+
+        if mode == "r" or exists:
+            self.scan()
+
+        if mode in ("a", "w"):
+            self.stream = open(path, "r+b" if exists else "wb")
+            if not exists:
+                self.stream.write(MAGIC)
+            self.stream.seek(self.end)
+            self.stream.truncate()
+        else:
+            self.stream = open(path, "rb")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        return len(self.index)
+
+    def close(self):
+        self.stream.close()
+
+    def scan(self):
+        size = os.path.getsize(self.path)
+        if self.size is not None:
+            size = min(size, self.size)
+
+        with open(self.path, "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise IOError("%s is not a graph archive" % self.path)
+
+            while self.end + RECORD.itemsize <= size:
+                record = np.frombuffer(f.read(RECORD.itemsize), dtype=RECORD)[0]
+
+                offset = self.end + RECORD.itemsize
+                if offset + record["size"] > size:
+                    break
+
+                self.index[int(record["frame"])] = (record, offset)
+                self.end = offset + int(record["size"])
+                f.seek(self.end)
+
+    def append(self, frame, time, num_nodes, edges):
+        payload, width, num_edges = encode_edges(num_nodes, edges, self.compress)
+
+        record = np.array([(frame, time, num_nodes, num_edges, len(payload), width, self.compress)], dtype=RECORD)
+        self.append_record(record[0], payload)
+
+    def append_record(self, record, payload):
+        # appends an encoded frame as returned by read_record
+        self.stream.write(record.tobytes())
+        self.stream.write(payload)
+        self.stream.flush()
+
+        self.index[int(record["frame"])] = (record, self.end + RECORD.itemsize)
+        self.end = self.stream.tell()
+
+    def sync(self):
+        # returns the end of the archive once its records are on disk
+        self.stream.flush()
+        os.fsync(self.stream.fileno())
+
+        return self.end
+
+    def frames(self):
+        return sorted(self.index.keys())
+
+    def time(self, frame):
+        return float(self.index[frame][0]["time"])
+
+    def read_record(self, frame):
+        # returns the frame's record header and its (still encoded) edges
+        record, offset = self.index[frame]
+
+        self.stream.seek(offset)
+        payload = self.stream.read(int(record["size"]))
+        self.stream.seek(self.end)
+
+        return record, payload
+
+    def read(self, frame):
+        # returns (number of nodes, (n_edges, 2) array of node pairs)
+        record, payload = self.read_record(frame)
+
+        num_nodes = int(record["nodes"])
+
+        return num_nodes, decode_edges(num_nodes, payload, int(record["width"]), int(record["edges"]), bool(record["compressed"]))
+
+
+def merge_archives(paths, output, sizes=None):
+    # copies the frames of several archives (e.g. of consecutive frame ranges
+    # of a trajectory) to a new archive without decoding them - sizes limits
+    # each archive to the records saved with its checkpoint
+    with GraphArchive(output, "w") as merged:
+        for path, size in zip(paths, sizes or [None] * len(paths)):
+            with GraphArchive(path, size=size) as archive:
+                for frame in archive.frames():
+                    merged.append_record(*archive.read_record(frame))
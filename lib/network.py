@@ -0,0 +1,444 @@
+import numpy as np
+
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import shortest_path
+
+# number of changed edges up to which IncrementalNetwork updates the previous
+# frame's shortest paths instead of recalculating them
+MAX_EDGE_CHANGES = 20
+
+
+def adjacency(num_nodes, edges):
+    # compressed sparse row (CSR) adjacency of an undirected graph given as an
+    # (n_edges, 2) array of node pairs - the neighbours of node i are
+    # indices[indptr[i]:indptr[i + 1]], in ascending order
+    edges = np.asarray(edges, dtype=np.intp).reshape(-1, 2)
+
+    rows = np.concatenate((edges[:, 0], edges[:, 1]))
+    cols = np.concatenate((edges[:, 1], edges[:, 0]))
+    order = np.lexsort((cols, rows))
+
+    indptr = np.zeros(num_nodes + 1, dtype=np.intp)
+    np.cumsum(np.bincount(rows, minlength=num_nodes), out=indptr[1:])
+
+    return indptr, cols[order]
+
+
+def distance_dtype(num_nodes):
+    # smallest integer type that can hold any path length (and -1)
+    return np.int16 if num_nodes < np.iinfo(np.int16).max else np.int32
+
+
+def shortest_path_lengths(indptr, indices, out=None, sources=None, max_elements=2**22):
+    # all-pairs shortest path lengths of an unweighted graph. Breadth-first
+    # searches are run from a block of source nodes at once - each level is a
+    # single sparse product of the block's frontier with the adjacency matrix
+    # - and written straight into the (num_nodes, num_nodes) integer distance
+    # matrix. Unreachable pairs are set to -1. If sources is given, only the
+    # rows of out for those nodes are (re)calculated.
+    num_nodes = len(indptr) - 1
+
+    if out is None:
+        out = np.empty((num_nodes, num_nodes), dtype=distance_dtype(num_nodes))
+
+    # rows are written in place when all sources are searched
+    in_place = sources is None
+
+    if in_place:
+        sources = np.arange(num_nodes)
+        out.fill(-1)
+
+    graph = csr_matrix((np.ones(len(indices), dtype=bool), indices, indptr), shape=(num_nodes, num_nodes))
+
+    # bound the number of (source, neighbour) pairs expanded per level
+    block = max(1, min(num_nodes, max_elements // max(1, len(indices))))
+
+    for start in range(0, len(sources), block):
+        block_sources = sources[start:start + block]
+        size = len(block_sources)
+
+        if in_place:
+            dist = out[start:start + size]
+        else:
+            dist = np.full((size, num_nodes), -1, dtype=out.dtype)
+
+        rows = np.arange(size)
+        nodes = block_sources
+        dist[rows, nodes] = 0
+
+        level = 0
+        while len(nodes):
+            level += 1
+
+            frontier = csr_matrix((np.ones(len(nodes), dtype=bool), (rows, nodes)), shape=(size, num_nodes))
+            reached = frontier.dot(graph).tocoo()
+
+            unseen = dist[reached.row, reached.col] < 0
+            rows, nodes = reached.row[unseen], reached.col[unseen]
+
+            dist[rows, nodes] = level
+
+        if not in_place:
+            out[block_sources] = dist
+
+    return out
+
+
+def insert_edge(dist, u, v):
+    # updates the shortest path lengths of a connected graph in place after
+    # the edge (u, v) has been added
+    du = dist[:, u].astype(np.int32)
+    dv = dist[:, v].astype(np.int32)
+
+    via = np.minimum(du[:, None] + 1 + dv[None, :], dv[:, None] + 1 + du[None, :])
+    np.minimum(dist, via, out=dist, casting="unsafe")
+
+
+def delete_edges(dist, indptr, indices, removed):
+    # updates the shortest path lengths in place after the (n, 2) edges in
+    # removed have been deleted (indptr/indices are the adjacency without
+    # them). A source's distances can only change if the far end of one of
+    # the deleted edges has no other parent on a shortest path from it, so
+    # only those sources are searched again - they are returned.
+    affected = np.zeros(dist.shape[0], dtype=bool)
+
+    for u, v in removed:
+        du, dv = dist[:, u], dist[:, v]
+        candidates = np.nonzero((np.abs(du.astype(np.int32) - dv) == 1) & ~affected)[0]
+
+        for near, far in ((u, v), (v, u)):
+            sources = candidates[dist[candidates, far] > dist[candidates, near]]
+            parents = indices[indptr[far]:indptr[far + 1]]
+
+            has_parent = (dist[np.ix_(sources, parents)] == (dist[sources, far] - 1)[:, None]).any(axis=1)
+            affected[sources[~has_parent]] = True
+
+    affected = np.nonzero(affected)[0]
+
+    if len(affected):
+        shortest_path_lengths(indptr, indices, out=dist, sources=affected)
+        dist[:, affected] = dist[affected].T
+
+    return affected
+
+
+class IncrementalNetwork(object):
+    # keeps the network of the previous frame so that the shortest path
+    # lengths can be updated from the edges that changed rather than
+    # recalculated. Falls back to a full calculation when more than
+    # max_changes edges changed or the previous network was disconnected.
+
+    def __init__(self, max_changes=MAX_EDGE_CHANGES):
+        self.max_changes = max_changes
+
+        self.num_nodes = None
+        self.keys = None
+
+        self.dist = None
+        self.dist_keys = None
+
+        self.bc = None
+        self.bc_keys = None
+
+    def update(self, num_nodes, edges):
+        if num_nodes != self.num_nodes:
+            self.dist_keys = self.bc_keys = None
+
+        edges = np.asarray(edges, dtype=np.intp).reshape(-1, 2)
+
+        self.num_nodes = num_nodes
+        self.keys = np.unique(edges[:, 0] * num_nodes + edges[:, 1])
+
+    def edges(self, keys):
+        return np.column_stack(np.divmod(keys, self.num_nodes))
+
+    def shortest_paths(self):
+        dist = None
+
+        if self.dist_keys is not None:
+            removed = np.setdiff1d(self.dist_keys, self.keys, assume_unique=True)
+            added = np.setdiff1d(self.keys, self.dist_keys, assume_unique=True)
+
+            if len(removed) + len(added) <= self.max_changes:
+                dist = self.update_shortest_paths(removed, added)
+
+        if dist is None:
+            indptr, indices = adjacency(self.num_nodes, self.edges(self.keys))
+            dist = shortest_path_lengths(indptr, indices)
+
+        # the update rules only hold for connected networks
+        if (dist < 0).any():
+            self.dist, self.dist_keys = None, None
+        else:
+            self.dist, self.dist_keys = dist, self.keys
+
+        return dist
+
+    def update_shortest_paths(self, removed, added):
+        dist = self.dist.copy()
+
+        if len(removed):
+            keys = np.setdiff1d(self.dist_keys, removed, assume_unique=True)
+            indptr, indices = adjacency(self.num_nodes, self.edges(keys))
+
+            affected = delete_edges(dist, indptr, indices, self.edges(removed))
+
+            if (dist[affected] < 0).any():
+                return None
+
+        for u, v in self.edges(added):
+            insert_edge(dist, u, v)
+
+        return dist
+
+    def betweenness(self, calculate=None):
+        # BC is only reused when the network has not changed at all
+        if self.bc_keys is None or not np.array_equal(self.bc_keys, self.keys):
+            if calculate is None:
+                indptr, indices = adjacency(self.num_nodes, self.edges(self.keys))
+                self.bc = betweenness_centrality(indptr, indices)
+            else:
+                self.bc = calculate(self.num_nodes, self.edges(self.keys))
+
+            self.bc_keys = self.keys
+
+        return self.bc.copy()
+
+
+class ContactPersistence(object):
+    # counts the frames in which each contact is present, in a single pass
+    # over the trajectory. Counts are kept in a dense num_nodes**2 array for
+    # networks with up to dense_limit nodes and as sorted edge keys with
+    # counts otherwise (memory then grows with the number of distinct
+    # contacts, not with the number of frames).
+
+    def __init__(self, dense_limit=4096, buffer_size=2**20):
+        self.dense_limit = dense_limit
+        self.buffer_size = buffer_size
+
+        self.num_nodes = None
+        self.frames = 0
+
+        self.counts = None
+        self.keys = None
+        self.buffer = []
+        self.buffered = 0
+
+    def allocate(self, num_nodes):
+        if self.num_nodes is None:
+            self.num_nodes = num_nodes
+            if num_nodes <= self.dense_limit:
+                self.counts = np.zeros(num_nodes * num_nodes, dtype=np.uint32)
+            else:
+                self.keys = np.zeros(0, dtype=np.int64)
+                self.counts = np.zeros(0, dtype=np.int64)
+        elif num_nodes != self.num_nodes:
+            raise ValueError("Expected %d nodes, found %d" % (self.num_nodes, num_nodes))
+
+    def add(self, num_nodes, edges):
+        self.allocate(num_nodes)
+
+        edges = np.sort(np.asarray(edges, dtype=np.int64).reshape(-1, 2), axis=1)
+        keys = np.unique(edges[:, 0] * num_nodes + edges[:, 1])
+
+        if self.keys is None:
+            self.counts[keys] += 1
+        else:
+            self.buffer.append(keys)
+            self.buffered += len(keys)
+
+            if self.buffered >= self.buffer_size:
+                self.merge()
+
+        self.frames += 1
+
+    def merge(self):
+        if not self.buffer:
+            return
+
+        keys = np.concatenate([self.keys] + self.buffer)
+        counts = np.concatenate([self.counts, np.ones(self.buffered, dtype=np.int64)])
+
+        self.keys, inverse = np.unique(keys, return_inverse=True)
+        self.counts = np.bincount(inverse, weights=counts).astype(np.int64)
+
+        self.buffer, self.buffered = [], 0
+
+    def combine(self, other):
+        # adds the counts of another ContactPersistence, e.g. one built over a
+        # different range of frames of the same trajectory
+        if not other.frames:
+            return self
+
+        self.allocate(other.num_nodes)
+        self.merge()
+        other.merge()
+
+        if other.keys is None:
+            keys = np.nonzero(other.counts)[0]
+            counts = other.counts[keys]
+        else:
+            keys, counts = other.keys, other.counts
+
+        if self.keys is None:
+            self.counts[keys] += counts.astype(self.counts.dtype)
+        else:
+            self.keys, inverse = np.unique(np.concatenate([self.keys, keys]), return_inverse=True)
+            self.counts = np.bincount(inverse, weights=np.concatenate([self.counts, counts])).astype(np.int64)
+
+        self.frames += other.frames
+
+        return self
+
+    def occupancy(self):
+        # returns the (n_contacts, 2) contacts seen in any frame and the
+        # fraction of frames each one was present in
+        if self.keys is None:
+            keys = np.nonzero(self.counts)[0]
+            counts = self.counts[keys]
+        else:
+            self.merge()
+            keys, counts = self.keys, self.counts
+
+        edges = np.column_stack(np.divmod(keys, self.num_nodes)).astype(np.intp)
+
+        return edges, counts / float(max(1, self.frames))
+
+
+def weighted_shortest_path_lengths(num_nodes, edges, lengths):
+    # all-pairs shortest path lengths (Dijkstra) of an undirected graph whose
+    # edges have the given lengths - unreachable pairs are set to inf
+    edges = np.asarray(edges, dtype=np.intp).reshape(-1, 2)
+    graph = csr_matrix((lengths, (edges[:, 0], edges[:, 1])), shape=(num_nodes, num_nodes))
+
+    return shortest_path(graph, method="D", directed=False)
+
+
+def batch_adjacency(num_nodes, edges_list):
+    # CSR adjacency of several graphs with the same number of nodes (e.g. the
+    # networks of consecutive frames), stacked as one block-diagonal graph
+    offsets = np.arange(len(edges_list)) * num_nodes
+    edges = np.concatenate([np.asarray(edges, dtype=np.intp).reshape(-1, 2) + offset for edges, offset in zip(edges_list, offsets)]) if len(edges_list) else np.zeros((0, 2), dtype=np.intp)
+
+    return adjacency(num_nodes * len(edges_list), edges)
+
+
+def source_dependencies(indptr, indices, sources=None, num_nodes=None, max_elements=2**22):
+    # Brandes' algorithm - yields (offset, delta) for a block of sources at a
+    # time, where delta[i, v] is the dependency of source i on node v and
+    # offset[i] is the index of the first node of the graph that source i
+    # belongs to. Path counts are propagated forward and dependencies
+    # backward one BFS level at a time for the whole block. For a
+    # block-diagonal graph from batch_adjacency, pass the size of each graph
+    # as num_nodes so that the work arrays are only num_nodes wide.
+    total_nodes = len(indptr) - 1
+
+    if num_nodes is None:
+        num_nodes = total_nodes
+
+    if sources is None:
+        sources = np.arange(total_nodes)
+
+    graph = csr_matrix((np.ones(len(indices)), indices, indptr), shape=(total_nodes, total_nodes))
+
+    block = max(1, min(len(sources), max_elements // max(1, num_nodes)))
+
+    for start in range(0, len(sources), block):
+        block_sources = sources[start:start + block]
+        size = len(block_sources)
+
+        offset = block_sources // num_nodes * num_nodes
+
+        dist = np.full((size, num_nodes), -1, dtype=np.int32)
+        sigma = np.zeros((size, num_nodes))
+        delta = np.zeros((size, num_nodes))
+
+        rows = np.arange(size)
+        nodes = block_sources - offset
+        dist[rows, nodes] = 0
+        sigma[rows, nodes] = 1
+
+        # forward pass - number of shortest paths from each source
+        levels = []
+        while len(rows):
+            levels.append((rows, nodes))
+
+            frontier = csr_matrix((sigma[rows, nodes], (rows, nodes + offset[rows])), shape=(size, total_nodes))
+            reached = frontier.dot(graph).tocoo()
+
+            cols = reached.col - offset[reached.row]
+            unseen = dist[reached.row, cols] < 0
+            rows, nodes = reached.row[unseen], cols[unseen]
+
+            dist[rows, nodes] = len(levels)
+            sigma[rows, nodes] = reached.data[unseen]
+
+        # backward pass - accumulate dependencies from the furthest level in
+        # (the sources themselves are excluded)
+        for level in range(len(levels) - 1, 1, -1):
+            rows, nodes = levels[level]
+
+            coeff = (1 + delta[rows, nodes]) / sigma[rows, nodes]
+            successors = csr_matrix((coeff, (rows, nodes + offset[rows])), shape=(size, total_nodes))
+            reached = successors.dot(graph).tocoo()
+
+            cols = reached.col - offset[reached.row]
+            parent = dist[reached.row, cols] == level - 1
+            rows, nodes = reached.row[parent], cols[parent]
+
+            delta[rows, nodes] += sigma[rows, nodes] * reached.data[parent]
+
+        yield offset, delta
+
+
+def betweenness_centrality(indptr, indices, num_nodes=None, max_elements=2**22):
+    # unnormalized betweenness centrality (as nx.betweenness_centrality with
+    # normalized=False). For a block-diagonal graph from batch_adjacency, pass
+    # the size of each graph as num_nodes - the result can then be reshaped
+    # to (n_graphs, num_nodes).
+    total_nodes = len(indptr) - 1
+
+    if num_nodes is None:
+        num_nodes = total_nodes
+
+    bc = np.zeros(total_nodes)
+
+    for offset, delta in source_dependencies(indptr, indices, num_nodes=num_nodes, max_elements=max_elements):
+        targets = offset[:, None] + np.arange(num_nodes)
+        bc += np.bincount(targets.ravel(), weights=delta.ravel(), minlength=total_nodes)
+
+    # every pair is counted from both ends in an undirected graph
+    return bc / 2
+
+
+def approximate_betweenness_centrality(indptr, indices, samples, seed=None, max_elements=2**22):
+    # estimates unnormalized betweenness centrality from the dependencies of
+    # a uniform sample of source nodes (pivots). Returns the estimate and its
+    # standard error per node, which is 0 once every node is a pivot.
+    num_nodes = len(indptr) - 1
+    samples = min(samples, num_nodes)
+
+    random = np.random.RandomState(seed)
+    sources = np.sort(random.choice(num_nodes, samples, replace=False))
+
+    total = np.zeros(num_nodes)
+    squares = np.zeros(num_nodes)
+
+    for offset, delta in source_dependencies(indptr, indices, sources, max_elements=max_elements):
+        total += delta.sum(axis=0)
+        squares += (delta**2).sum(axis=0)
+
+    bc = total * num_nodes / samples / 2
+
+    if samples < 2:
+        return bc, np.full(num_nodes, np.nan)
+
+    # sample variance of the dependencies, with a finite population correction
+    # as pivots are drawn without replacement
+    mean = total / samples
+    variance = np.maximum(squares - samples * mean**2, 0) / (samples - 1)
+    correction = float(num_nodes - samples) / max(1, num_nodes - 1)
+
+    error = num_nodes * np.sqrt(variance / samples * correction) / 2
+
+    return bc, error
@@ -0,0 +1,97 @@
+import numpy as np
+
+import collections, multiprocessing, matplotlib
+
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+
+
+def plot_nodes(values, path, title, x_label="Node Indices", y_label="", error=None, zero_line=False):
+    # line plot of one value per node (e.g. the BC of a single frame)
+    nodes_axis = range(1, len(values) + 1)
+
+    if error is not None:
+        plt.errorbar(nodes_axis, values, error, ecolor="red")
+    else:
+        plt.plot(nodes_axis, values)
+
+    if zero_line:
+        plt.axhline(0, color='black')
+
+    plt.title(title, fontsize=18)
+    plt.xlabel(x_label, fontsize=16)
+    plt.ylabel(y_label, fontsize=16)
+    plt.savefig(path, dpi=300, bbox_inches='tight', format="png")
+    plt.close()
+
+
+def plot_summary(matrix, path, title, times=None, x_label="Node Indices", y_label=""):
+    # a single figure for all frames - the per-node values of every frame as
+    # a heat map (one row per frame) above their mean and standard deviation
+    matrix = np.atleast_2d(matrix)
+    num_frames, num_nodes = matrix.shape
+    nodes_axis = np.arange(1, num_nodes + 1)
+
+    if times is None:
+        times = np.arange(num_frames)
+
+    start, end = min(times), max(times)
+    if start == end:
+        start, end = start - 0.5, end + 0.5
+
+    fig, (top, bottom) = plt.subplots(2, 1, figsize=(12, 10), sharex=True)
+
+    image = top.imshow(matrix, aspect="auto", origin="lower", interpolation="nearest", extent=(0.5, num_nodes + 0.5, start, end))
+    fig.colorbar(image, ax=(top, bottom), label=y_label)
+
+    top.set_title(title, fontsize=18)
+    top.set_ylabel("Time", fontsize=16)
+
+    mean, std = matrix.mean(axis=0), matrix.std(axis=0)
+    bottom.plot(nodes_axis, mean, color="black")
+    bottom.fill_between(nodes_axis, mean - std, mean + std, color="red", alpha=0.3, linewidth=0)
+
+    bottom.set_xlabel(x_label, fontsize=16)
+    bottom.set_ylabel("%s (mean and std dev)" % y_label, fontsize=16)
+
+    fig.savefig(path, dpi=150, bbox_inches='tight', format="png")
+    plt.close(fig)
+
+
+class PlotQueue(object):
+    # renders plots separately from the calculation. With workers, plots are
+    # drawn in background processes (only a few per worker are queued before
+    # submit waits for the oldest); without, they are drawn straight away.
+
+    def __init__(self, workers=0):
+        self.workers = workers
+        self.pool = multiprocessing.Pool(workers) if workers > 0 else None
+        self.pending = collections.deque()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *args):
+        self.close(wait=exc_type is None)
+
+    def submit(self, function, *args, **kwargs):
+        if self.pool is None:
+            function(*args, **kwargs)
+            return
+
+        self.pending.append(self.pool.apply_async(function, args, kwargs))
+
+        while len(self.pending) > 4 * self.workers:
+            self.pending.popleft().get()
+
+    def close(self, wait=True):
+        if self.pool is None:
+            return
+
+        try:
+            while wait and self.pending:
+                self.pending.popleft().get()
+        finally:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
@@ -0,0 +1,108 @@
+import numpy as np
+
+from lib.strategies import normalization
+
+
+class RunningStats(object):
+    # running mean and standard deviation of equally shaped arrays (e.g. the
+    # BC of every frame), updated one array at a time with Welford's method so
+    # that the arrays never have to be held in memory together
+
+    def __init__(self):
+        self.count = 0
+        self.mean = None
+        self.m2 = None
+
+    def add(self, values):
+        values = np.asarray(values, dtype=np.float64)
+
+        if self.mean is None:
+            self.mean = np.zeros(values.shape)
+            self.m2 = np.zeros(values.shape)
+
+        self.count += 1
+
+        delta = values - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (values - self.mean)
+
+    def merge(self, other):
+        # combines the statistics of two sets of arrays (Chan et al.)
+        if not other.count:
+            return self
+
+        if not self.count:
+            self.count, self.mean, self.m2 = other.count, other.mean.copy(), other.m2.copy()
+            return self
+
+        count = self.count + other.count
+        delta = other.mean - self.mean
+
+        self.mean = self.mean + delta * other.count / count
+        self.m2 = self.m2 + other.m2 + delta**2 * self.count * other.count / count
+        self.count = count
+
+        return self
+
+    def std(self, ddof=0):
+        # population standard deviation by default, as numpy's std
+        return np.sqrt(self.m2 / max(1, self.count - ddof))
+
+
+class FrameAverages(object):
+    # running statistics of per-frame results keyed by name (e.g. "BC" and
+    # "L"). With a normalization mode (see lib.strategies.normalization), the
+    # statistics of each result's delta from its first frame are given as
+    # well, under "delta_<name>" - as calc_delta.py with the first frame as
+    # the reference and the frames after it as the alternatives. The delta of
+    # a frame is an affine function of its values, so its statistics follow
+    # from those of the frames after the reference (kept apart from the
+    # statistics of all frames), and averages of consecutive frame ranges can
+    # be merged.
+
+    def __init__(self, delta_mode=None):
+        self.delta_mode = delta_mode
+        self.stats = {}
+        self.references = {}
+        self.deltas = {}
+
+    def add(self, name, values):
+        values = np.asarray(values, dtype=np.float64).ravel()
+        self.stats.setdefault(name, RunningStats()).add(values)
+
+        if self.delta_mode is None:
+            return
+
+        if name in self.references:
+            self.deltas.setdefault(name, RunningStats()).add(values)
+        else:
+            self.references[name] = values
+
+    def merge(self, other):
+        # other holds the frames that follow those of this one
+        for name, stats in other.stats.items():
+            if name in self.references:
+                # every frame of other comes after the reference
+                self.deltas.setdefault(name, RunningStats()).merge(stats)
+            elif name in other.references:
+                self.references[name] = other.references[name]
+                self.deltas.setdefault(name, RunningStats()).merge(other.deltas.get(name, RunningStats()))
+
+            self.stats.setdefault(name, RunningStats()).merge(stats)
+
+        return self
+
+    def names(self):
+        # a delta needs at least one frame after the reference
+        return sorted(list(self.stats.keys()) + ["delta_%s" % name for name, stats in self.deltas.items() if stats.count])
+
+    def result(self, name):
+        # (mean, standard deviation) of the named result
+        if name in self.stats:
+            return self.stats[name].mean, self.stats[name].std()
+
+        name = name[len("delta_"):]
+        stats, reference = self.deltas[name], self.references[name]
+        normalizer = getattr(normalization, self.delta_mode)(name)
+
+        return normalizer.normalize(stats.mean - reference, reference), np.abs(normalizer.normalize(stats.std(), reference))
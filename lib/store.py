@@ -0,0 +1,178 @@
+import os
+import numpy as np
+
+from numpy.lib import format as npy
+
+
+HEADER = np.dtype([("frame", "<i8"), ("time", "<f8"), ("name", "<U32")])
+
+
+class ResultStore(object):
+    # a single appendable binary file holding per-frame results (e.g. the BC
+    # and L of every frame in a trajectory). The file is a sequence of .npy
+    # arrays - each entry is a one-element header (frame index, frame time,
+    # dataset name) followed by the data. Later entries for the same dataset
+    # and frame replace earlier ones, and an incomplete entry at the end of
+    # the file (from an interrupted run) is ignored and overwritten. Mode "w"
+    # starts a new store, replacing any existing file, and "a" appends to it
+    # (e.g. when resuming a run). A size (the end of the store saved with a
+    # checkpoint) ignores any entries after it - with mode "a" they are
+    # dropped from the file.
+
+    def __init__(self, path, mode="r", size=None):
+        self.path = path
+        self.mode = mode
+        self.size = size
+        self.index = {}
+        self.end = 0
+
+        exists = mode != "w" and os.path.exists(path)
+
+        if mode == "r" or exists:
+            self.scan()
+
+        if mode in ("a", "w"):
+            self.stream = open(path, "r+b" if exists else "wb")
+            self.stream.seek(self.end)
+            self.stream.truncate()
+        else:
+            self.stream = open(path, "rb")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.stream.close()
+
+    def scan(self):
+        size = os.path.getsize(self.path)
+        if self.size is not None:
+            size = min(size, self.size)
+
+        with open(self.path, "rb") as f:
+            while self.end < size:
+                try:
+                    header = npy.read_array(f)[0]
+
+                    offset = f.tell()
+                    version = npy.read_magic(f)
+                    if version == (1, 0):
+                        shape, fortran_order, dtype = npy.read_array_header_1_0(f)
+                    else:
+                        shape, fortran_order, dtype = npy.read_array_header_2_0(f)
+
+                    f.seek(int(np.prod(shape)) * dtype.itemsize, os.SEEK_CUR)
+                    if f.tell() > size:
+                        break
+
+                except Exception:
+                    break
+
+                self.index.setdefault(str(header["name"]), {})[int(header["frame"])] = (float(header["time"]), offset)
+                self.end = f.tell()
+
+    def append(self, frame, time, name, data):
+        npy.write_array(self.stream, np.array([(frame, time, name)], dtype=HEADER))
+
+        offset = self.stream.tell()
+        npy.write_array(self.stream, np.ascontiguousarray(data))
+        self.stream.flush()
+
+        self.end = self.stream.tell()
+        self.index.setdefault(name, {})[frame] = (time, offset)
+
+    def sync(self):
+        # returns the end of the store once its entries are on disk
+        self.stream.flush()
+        os.fsync(self.stream.fileno())
+
+        return self.end
+
+    def datasets(self):
+        return sorted(self.index.keys())
+
+    def frames(self, name):
+        return sorted(self.index[name].keys())
+
+    def times(self, name):
+        return np.array([self.index[name][frame][0] for frame in self.frames(name)])
+
+    def read(self, name, frame):
+        self.stream.seek(self.index[name][frame][1])
+        data = npy.read_array(self.stream)
+        self.stream.seek(self.end)
+
+        return data
+
+    def read_all(self, name):
+        return np.array([self.read(name, frame) for frame in self.frames(name)])
+
+
+def merge_stores(paths, output, sizes=None):
+    # writes the entries of several stores (e.g. of consecutive frame ranges
+    # of a trajectory) to a new store, in order - sizes limits each store to
+    # the entries saved with its checkpoint
+    with ResultStore(output, "w") as merged:
+        for path, size in zip(paths, sizes or [None] * len(paths)):
+            with ResultStore(path, size=size) as store:
+                entries = sorted((offset, frame, time, name) for name, frames in store.index.items() for frame, (time, offset) in frames.items())
+
+                for _, frame, time, name in entries:
+                    merged.append(frame, time, name, store.read(name, frame))
+
+
+def parse_spec(spec):
+    # splits a <store>:<dataset>[:<frame>] specification - returns None for
+    # anything else (e.g. a .dat file)
+    if os.path.exists(spec) or ":" not in spec:
+        return None
+
+    parts = spec.split(":")
+    if not os.path.exists(parts[0]) or len(parts) > 3:
+        return None
+
+    frame = int(parts[2]) if len(parts) == 3 else None
+
+    return parts[0], parts[1], frame
+
+
+def iter_data(specs):
+    # yields (title, frame, time, matrix) for the matrices in the given text
+    # files and result store datasets - titles of stored frames follow the
+    # names of the .dat files written by calc_network.py
+    for spec in specs:
+        parsed = parse_spec(spec)
+
+        if parsed is None:
+            yield ".".join(spec.split(".")[:-1]), None, None, np.loadtxt(spec)
+            continue
+
+        path, name, frame = parsed
+        store_name = ".".join(os.path.basename(path).split(".")[:-1])
+
+        with ResultStore(path) as store:
+            frames = store.frames(name) if frame is None else [frame]
+
+            for frame in frames:
+                time = store.index[name][frame][0]
+                yield "%s_%d_%s" % (store_name, time, name), frame, time, store.read(name, frame)
+
+
+def load_data(spec):
+    # reads a matrix from a text file or a result store - a store dataset
+    # without a frame index gives the matrices of all frames stacked
+    parsed = parse_spec(spec)
+
+    if parsed is None:
+        return np.loadtxt(spec)
+
+    path, name, frame = parsed
+
+    with ResultStore(path) as store:
+        if frame is None:
+            return store.read_all(name)
+
+        return store.read(name, frame)
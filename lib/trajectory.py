@@ -1,10 +1,157 @@
-import os, math
+import os, json, hashlib, itertools, threading
+import numpy as np
 import mdtraj as md
 
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from scipy.spatial import cKDTree
+
+from lib.utils import replace_file
+
+NODE_FILTER = "(name CB and protein) or (name CA and resname GLY)"
+
+RESIDUE = np.dtype([("chain", "<i4"), ("name", "<U8"), ("resSeq", "<i8")])
+
+
+def get_atom_filter(ligands=None):
+    # the atoms used as network nodes - CB atoms (CA for glycine) and any
+    # ligand atoms given as RESNAME:ATOM,RESNAME:ATOM
+    atom_filter = NODE_FILTER
+    if ligands:
+        ligands = ligands.split(",")
+
+        for ligand in ligands:
+            arr = ligand.split(":")
+            atom_filter += " or (name %s and resname %s)" % (arr[1], arr[0])
+
+    return atom_filter
+
+
+def load_topology(trajectory, topology=None):
+    return md.load_topology(topology if topology else trajectory)
+
+
+def select_nodes(topology, atom_filter=NODE_FILTER):
+    # resolves an atom selection once per run - returns the selected atom
+    # indices (to be passed to load_trajectory as atom_indices) and a table
+    # with the chain index, residue name and residue number of each of them
+    indices = topology.select(atom_filter)
+
+    residues = np.zeros(len(indices), dtype=RESIDUE)
+    for i, index in enumerate(indices):
+        residue = topology.atom(index).residue
+        residues[i] = (residue.chain.index, residue.name, residue.resSeq)
+
+    return indices, residues
+
+
+def count_frames(trajectory):
+    # number of frames in a trajectory file - read from the file's header or
+    # offsets where the format has them, without loading any co-ordinates
+    with md.open(trajectory) as f:
+        return len(f)
+
+
+def parse_shard(shard):
+    # "i/n" (e.g. 2/4) -> (i, n), with shards numbered from 1
+    index, count = [int(part) for part in shard.split("/")]
+    if count < 1 or not 1 <= index <= count:
+        raise ValueError("Invalid shard %s - expected i/n with 1 <= i <= n" % shard)
+
+    return index, count
+
+
+def frame_range(trajectory, step=1, start=None, end=None, shard=None):
+    # resolves --frame-start/--frame-end (trajectory frames, end exclusive)
+    # and --shard (i, n) into the range [first, stop) of the frames a run over
+    # the whole trajectory with the same step would process, numbered as that
+    # run numbers them. Returns (first, stop, number of frames in the stepped
+    # trajectory), or None if no range was given.
+    if start is None and end is None and shard is None:
+        return None
+
+    step = step or 1
+    total = -(-count_frames(trajectory) // step)
+
+    first = min(total, -(-(start or 0) // step))
+    stop = total if end is None else max(first, min(total, -(-end // step)))
+
+    if shard is not None:
+        index, count = shard
+        size = stop - first
+        first, stop = first + size * (index - 1) // count, first + size * index // count
+
+    return first, stop, total
+
+
+def read_frames(trajectory, topology, step=1, atom_indices=None, skip=0, n_frames=None):
+    # reads n_frames (default: all remaining) frames, every step-th one,
+    # after seeking past the first skip frames of the stepped trajectory, so
+    # that the skipped frames are not read. Formats without random access
+    # are loaded in full and sliced.
+    try:
+        with md.open(trajectory) as f:
+            f.seek(skip * step)
+            return f.read_as_traj(load_topology(trajectory, topology), n_frames=n_frames, stride=step, atom_indices=atom_indices)
+    except (AttributeError, NotImplementedError, TypeError):
+        traj = md.load(trajectory, top=topology, atom_indices=atom_indices)[::step][skip:]
+        return traj if n_frames is None else traj[:n_frames]
+
+
+def read_ahead(iterable, depth=1):
+    # yields the items of iterable while a background thread reads up to
+    # depth items ahead - e.g. the next chunks of a trajectory are read and
+    # decoded while the current one is processed. Errors raised by the reader
+    # are raised here, and the reader stops when the consumer does.
+    items = queue.Queue(depth)
+    stop = threading.Event()
+    done = object()
+
+    def put(entry):
+        while not stop.is_set():
+            try:
+                items.put(entry, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def read():
+        try:
+            for item in iterable:
+                if not put((item, None)):
+                    return
+            put((done, None))
+        except Exception as ex:
+            put((None, ex))
+
+    reader = threading.Thread(target=read)
+    reader.daemon = True
+    reader.start()
+
+    try:
+        while True:
+            item, error = items.get()
+            if error is not None:
+                raise error
+            if item is done:
+                return
+            yield item
+    finally:
+        stop.set()
+
+
 class MDIterator(object):
 
-    def __init__(self, traj_file, top, chunk=100, stride=1):
-        self.iterator = md.iterload(traj_file, top=top, chunk=chunk, stride=stride)
+    def __init__(self, traj_file, top, chunk=100, stride=1, atom_indices=None, skip=0, n_frames=None, prefetch=0):
+        # with prefetch, up to that many chunks are read ahead in a background
+        # thread (see read_ahead)
+        self.iterator = self.limit(md.iterload(traj_file, top=top, chunk=chunk, stride=stride, atom_indices=atom_indices, skip=skip), n_frames)
+        if prefetch:
+            self.iterator = read_ahead(self.iterator, prefetch)
         self.trajectory = None
 
         self.index = chunk - 1
@@ -28,6 +175,22 @@ class MDIterator(object):
     def next(self):
         return self.__next__()
 
+    def chunks(self):
+        for chunk in self.iterator:
+            yield chunk
+
+    @staticmethod
+    def limit(iterator, n_frames=None):
+        # stops after n_frames frames (default: the end of the trajectory)
+        for chunk in iterator:
+            if n_frames is not None:
+                if n_frames <= 0:
+                    break
+                chunk = chunk[:n_frames]
+                n_frames -= len(chunk)
+
+            yield chunk
+
 def reduce_trajectory(trajectory, top=None, stride=1, output_path="minimized.dcd"):
     traj = md.load(trajectory, top=top)[::int(stride)]
     traj.save(output_path)
@@ -38,20 +201,452 @@ def save_frame(trajectory, topology, frame_index, file_format="pdb"):
     frame = md.load_frame(trajectory, frame_index, top=topology)
     frame.save(frame_name)
 
-def load_trajectory(trajectory, topology, step=1, lazy_load=False):
-    if not lazy_load:
-        traj = md.load(trajectory, top=topology)[::step]
+class CachedTrajectory(object):
+    # co-ordinates, times and unit cell vectors of the frames of a trajectory
+    # from a CoordinateCache - the arrays are memory-mapped, so frames are only
+    # read from disk as they are used. Slicing gives a range of frames.
+
+    def __init__(self, xyz, time, unitcell_vectors=None):
+        self.xyz = xyz
+        self.time = time
+        self.unitcell_vectors = unitcell_vectors
+
+    def __len__(self):
+        return len(self.xyz)
+
+    def __getitem__(self, frames):
+        return CachedTrajectory(self.xyz[frames], self.time[frames], None if self.unitcell_vectors is None else self.unitcell_vectors[frames])
+
+    @property
+    def n_frames(self):
+        return len(self.xyz)
+
+
+class CoordinateCache(object):
+    # directory of reduced trajectories shared by the MD-TASK tools - the
+    # co-ordinates of the selected atoms of every step-th frame are written
+    # once to <key>.npy (with <key>_time.npy, <key>_box.npy and a <key>.json
+    # description) and memory-mapped by later runs. Entries are keyed by the
+    # trajectory (path, size and modification time), the topology, the atom
+    # selection and the step. When the cache grows beyond max_size bytes, the
+    # least recently used entries are removed.
+
+    def __init__(self, directory, max_size=10 * 2**30):
+        self.directory = directory
+        self.max_size = max_size
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def key(self, trajectory, topology=None, atom_indices=None, step=1):
+        def identify(path):
+            stat = os.stat(path)
+            return [os.path.abspath(path), stat.st_size, stat.st_mtime]
+
+        selection = "all" if atom_indices is None else hashlib.sha1(np.asarray(atom_indices, dtype=np.int64).tobytes()).hexdigest()
+        parts = [identify(trajectory), identify(topology) if topology else None, selection, step]
+
+        return hashlib.sha1(json.dumps(parts).encode("utf-8")).hexdigest()
+
+    def path(self, key, suffix=""):
+        return os.path.join(self.directory, "%s%s" % (key, suffix))
+
+    def get(self, trajectory, topology=None, atom_indices=None, step=1, chunk=100, build=True, prefetch=0):
+        # returns the CachedTrajectory of the trajectory - if it is not in the
+        # cache yet, it is read (a chunk at a time, prefetch chunks ahead) and
+        # added when build is set, and None is returned otherwise
+        key = self.key(trajectory, topology, atom_indices, step)
+
+        traj = self.load(key)
+        if traj is None and build:
+            traj = self.build(key, trajectory, topology, atom_indices, step, chunk, prefetch)
+
+        return traj
+
+    def load(self, key):
+        if not os.path.exists(self.path(key, ".json")):
+            return None
+
+        try:
+            xyz = np.load(self.path(key, ".npy"), mmap_mode="r")
+            time = np.load(self.path(key, "_time.npy"))
+            box = np.load(self.path(key, "_box.npy"), mmap_mode="r") if os.path.exists(self.path(key, "_box.npy")) else None
+        except (IOError, ValueError):
+            return None
+
+        # the description's modification time marks the last use of the entry
+        os.utime(self.path(key, ".json"), None)
+
+        return CachedTrajectory(xyz, time, box)
+
+    def build(self, key, trajectory, topology, atom_indices, step, chunk, prefetch=0):
+        n_frames = -(-count_frames(trajectory) // step)
+        n_atoms = len(atom_indices) if atom_indices is not None else load_topology(trajectory, topology).n_atoms
+
+        # entries that could never fit are not written
+        size = n_frames * n_atoms * 3 * 4
+        if size > self.max_size:
+            return None
+
+        # files are written under temporary names and renamed once complete,
+        # so runs sharing the cache never see a partial entry
+        temp = "_%d.tmp" % os.getpid()
+        xyz = np.lib.format.open_memmap(self.path(key, ".npy" + temp), mode="w+", dtype=np.float32, shape=(n_frames, n_atoms, 3))
+        time, box = None, None
+
+        row = 0
+        for block in MDIterator(trajectory, top=topology, chunk=chunk, stride=step, atom_indices=atom_indices, prefetch=prefetch).chunks():
+            if time is None:
+                time = np.zeros(n_frames, dtype=block.time.dtype)
+                if block.unitcell_vectors is not None:
+                    box = np.zeros((n_frames, 3, 3), dtype=np.float32)
+
+            xyz[row:row + len(block)] = block.xyz
+            time[row:row + len(block)] = block.time
+            if box is not None:
+                box[row:row + len(block)] = block.unitcell_vectors
+
+            row += len(block)
+
+        xyz.flush()
+        del xyz
+
+        if row != n_frames:
+            os.remove(self.path(key, ".npy" + temp))
+            return None
+
+        with open(self.path(key, "_time.npy" + temp), "wb") as f:
+            np.save(f, time)
+        replace_file(self.path(key, "_time.npy" + temp), self.path(key, "_time.npy"))
+
+        if box is not None:
+            with open(self.path(key, "_box.npy" + temp), "wb") as f:
+                np.save(f, box)
+            replace_file(self.path(key, "_box.npy" + temp), self.path(key, "_box.npy"))
+
+        replace_file(self.path(key, ".npy" + temp), self.path(key, ".npy"))
+
+        description = {"trajectory": os.path.abspath(trajectory), "topology": os.path.abspath(topology) if topology else None,
+                       "atoms": n_atoms, "frames": n_frames, "step": step}
+        with open(self.path(key, ".json" + temp), "w") as f:
+            json.dump(description, f)
+        replace_file(self.path(key, ".json" + temp), self.path(key, ".json"))
+
+        self.evict(key)
+
+        return self.load(key)
+
+    def entries(self):
+        # (last use, key, size in bytes) of every entry, least recently used first
+        entries = []
+
+        for name in os.listdir(self.directory):
+            if not name.endswith(".json"):
+                continue
+
+            key = name[:-len(".json")]
+            files = [self.path(key, suffix) for suffix in (".json", ".npy", "_time.npy", "_box.npy")]
+            size = sum(os.path.getsize(path) for path in files if os.path.exists(path))
+
+            entries.append((os.path.getmtime(files[0]), key, size))
+
+        return sorted(entries)
+
+    def evict(self, keep=None):
+        entries = self.entries()
+        total = sum(size for _, _, size in entries)
+
+        for _, key, size in entries:
+            if total <= self.max_size:
+                break
+            if key == keep:
+                continue
+
+            # the description goes first, so the entry is never half-removed
+            for suffix in (".json", ".npy", "_time.npy", "_box.npy"):
+                if os.path.exists(self.path(key, suffix)):
+                    os.remove(self.path(key, suffix))
+
+            total -= size
+
+
+def load_trajectory(trajectory, topology, step=1, lazy_load=False, chunk=100, atom_indices=None, skip=0, n_frames=None, cache=None, prefetch=0):
+    # with atom_indices (e.g. from select_nodes), only those atoms are read.
+    # skip is the number of (stepped) frames to leave out at the start and
+    # n_frames the number to read after them (default: up to the end) - the
+    # reader seeks past the skipped frames without reading them. With a
+    # CoordinateCache, the frames are memory-mapped from the cache (runs over
+    # the whole trajectory add it to the cache if it is not there yet).
+    # prefetch is the number of chunks a lazily loaded trajectory reads ahead.
+    if cache is not None:
+        traj = cache.get(trajectory, topology, atom_indices, step or 1, chunk, not skip and n_frames is None, prefetch)
+
+        if traj is not None:
+            traj = traj[skip:] if n_frames is None else traj[skip:skip + n_frames]
+            return traj, len(traj)
+
+    if not lazy_load and not skip and n_frames is None:
+        traj = md.load(trajectory, top=topology, atom_indices=atom_indices)[::step]
+        total_frames = len(traj)
+    elif not lazy_load:
+        traj = read_frames(trajectory, topology, step or 1, atom_indices, skip, n_frames)
         total_frames = len(traj)
     else:
-        traj = MDIterator(trajectory, top=topology, stride=step)
-        total_frames = None
+        traj = MDIterator(trajectory, top=topology, chunk=chunk, stride=step, atom_indices=atom_indices, skip=skip * (step or 1), n_frames=n_frames, prefetch=prefetch)
+        total_frames = n_frames
 
     return traj, total_frames
 
+class CoordinateIterator(object):
+    # iterates over the co-ordinates of the frames of a loaded trajectory or
+    # an MDIterator without creating an md.Trajectory per frame. Each frame is
+    # an (n_atoms, 3) view into the co-ordinates of its chunk (copy it to keep
+    # it once the next chunk is read), restricted to atom_indices if the
+    # trajectory was loaded with more atoms. chunks() yields the (n_frames,
+    # n_atoms, 3) co-ordinates, the times and the unit cell vectors (None
+    # without periodic boundaries) of up to chunk_size frames at a time for
+    # vectorized consumers.
+
+    def __init__(self, traj, chunk_size=100, atom_indices=None):
+        self.traj = traj
+        self.atom_indices = atom_indices
+        self.chunk_size = traj.chunk if isinstance(traj, MDIterator) else chunk_size
+
+    def __iter__(self):
+        for xyz, _, _ in self.chunks():
+            for frame in xyz:
+                yield frame
+
+    def chunks(self):
+        if isinstance(self.traj, MDIterator):
+            blocks = ((block.xyz, block.time, block.unitcell_vectors) for block in self.traj.chunks())
+        else:
+            coords, times, cells, size = self.traj.xyz, self.traj.time, self.traj.unitcell_vectors, self.chunk_size
+            blocks = ((coords[start:start + size], times[start:start + size], None if cells is None else cells[start:start + size]) for start in range(0, len(coords), size))
+
+        for xyz, time, box in blocks:
+            if self.atom_indices is not None:
+                xyz = xyz[:, self.atom_indices]
+
+            yield xyz, time, box
+
+def periodic_boxes(boxes, cutoff=0.):
+    # the unit cell vectors (one per row, as mdtraj's unitcell_vectors) of one
+    # (3, 3) or several (n_frames, 3, 3) frames that the minimum image
+    # convention can be applied with. Cells without volume (trajectories
+    # without periodic boundaries) or narrower than twice the cutoff (where
+    # more than one image of an atom could be within it) are zeroed, and None
+    # is returned if no cell is usable.
+    if boxes is None:
+        return None
+
+    boxes = np.array(boxes, dtype=np.float64)
+    cells = boxes.reshape(-1, 3, 3)
+
+    a, b, c = cells[:, 0], cells[:, 1], cells[:, 2]
+    volume = np.abs(np.linalg.det(cells))
+    areas = np.linalg.norm(np.stack((np.cross(b, c), np.cross(c, a), np.cross(a, b)), axis=1), axis=2)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        widths = (volume[:, None] / areas).min(axis=1)
+
+    usable = (volume > 0) & (widths > 2 * cutoff)
+    if not usable.any():
+        return None
+
+    cells[~usable] = 0
+
+    return boxes
+
+
+def is_triclinic(boxes):
+    boxes = np.asarray(boxes).reshape(-1, 3, 3)
+    return bool(np.any(boxes * (1 - np.eye(3))))
+
+
+def minimum_image(diff, boxes):
+    # displacements diff (n_frames, ..., 3) moved to their nearest periodic
+    # image, with the cell of each frame in boxes (n_frames, 3, 3) - or a
+    # single frame's (..., 3) displacements and (3, 3) cell. Frames with a
+    # zeroed cell (see periodic_boxes) are left as they are. Triclinic cells
+    # are searched over the neighbouring images, as wrapping the fractional
+    # co-ordinates alone does not always give the nearest one.
+    single = boxes.ndim == 2
+    if single:
+        diff, boxes = diff[None], boxes[None]
+
+    shape = diff.shape
+    diff = diff.reshape(shape[0], -1, 3)
+
+    valid = np.abs(np.linalg.det(boxes)) > 0
+    cells = np.where(valid[:, None, None], boxes, np.eye(3))
+
+    # displacements already within half a cell are returned unchanged
+    shifts = np.round(np.matmul(diff, np.linalg.inv(cells)))
+    shifts[~valid] = 0
+    wrapped = diff - np.matmul(shifts, cells).astype(diff.dtype)
+
+    if is_triclinic(boxes):
+        images = np.array([(i, j, k) for i in (-1, 0, 1) for j in (-1, 0, 1) for k in (-1, 0, 1)], dtype=np.float64)
+
+        for f in np.nonzero(valid)[0]:
+            if not is_triclinic(cells[f]):
+                continue
+
+            candidates = wrapped[f][:, None, :] + images.dot(cells[f]).astype(diff.dtype)[None]
+            nearest = np.argmin((candidates**2).sum(axis=2), axis=1)
+            wrapped[f] = candidates[np.arange(len(nearest)), nearest]
+
+    wrapped = wrapped.reshape(shape)
+
+    return wrapped[0] if single else wrapped
+
+
+def pair_distances(xyz, pairs, box=None, dtype=np.float64):
+    # distances between the atoms of each (i, j) pair - xyz is a frame
+    # (n_atoms, 3) or a block of frames (n_frames, n_atoms, 3) and one
+    # distance (or a row of them per frame) is returned per pair. With unit
+    # cell vectors (see periodic_boxes), the minimum image convention is used.
+    xyz = np.asarray(xyz, dtype=dtype)
+    pairs = np.asarray(pairs, dtype=np.intp).reshape(-1, 2)
+
+    diff = xyz[..., pairs[:, 1], :] - xyz[..., pairs[:, 0], :]
+    if box is not None:
+        diff = minimum_image(diff, box)
+
+    return np.sqrt((diff**2).sum(axis=-1))
+
+
+def distance_block(xyz, rows=None, cols=None, box=None, dtype=np.float64):
+    # distances between every atom in rows and every atom in cols (indices or
+    # slices, default: all atoms) - an (n_rows, n_cols) array for a frame
+    # (n_atoms, 3) or (n_frames, n_rows, n_cols) for a block of frames, with
+    # the minimum image convention applied as in pair_distances
+    xyz = np.asarray(xyz, dtype=dtype)
+    rows = slice(None) if rows is None else rows
+    cols = slice(None) if cols is None else cols
+
+    diff = xyz[..., rows, None, :] - xyz[..., None, cols, :]
+    if box is not None:
+        diff = minimum_image(diff, box)
+
+    return np.sqrt((diff**2).sum(axis=-1))
+
+
 def calc_distance(frame, index1, index2):
-    atom1 = frame.xyz[0, index1]
-    atom2 = frame.xyz[0, index2]
+    box = None if frame.unitcell_vectors is None else periodic_boxes(frame.unitcell_vectors[0])
+
+    return float(pair_distances(frame.xyz[0], [(index1, index2)], box)[0])
+
+
+def cell_images(xyz, box, cutoff):
+    # the co-ordinates (n_atoms, 3) wrapped into a triclinic cell, followed
+    # by the images of the atoms within cutoff of its faces in the
+    # neighbouring cells - every atom within cutoff of a wrapped atom (the
+    # cell being wider than twice the cutoff, see periodic_boxes) is then
+    # one of the points. The index of the atom of each point is returned too.
+    frac = xyz.dot(np.linalg.inv(box))
+    frac -= np.floor(frac)
+
+    # the cutoff as a fraction of the cell's width across each pair of faces
+    volume = abs(np.linalg.det(box))
+    areas = np.linalg.norm([np.cross(box[1], box[2]), np.cross(box[2], box[0]), np.cross(box[0], box[1])], axis=1)
+    margin = cutoff * areas / volume
+
+    points, atoms = [frac], [np.arange(len(xyz))]
+
+    for shift in itertools.product((-1, 0, 1), repeat=3):
+        if not any(shift):
+            continue
+
+        shifted = frac + shift
+        near = np.nonzero(np.all((shifted > -margin) & (shifted < 1 + margin), axis=1))[0]
+
+        points.append(shifted[near])
+        atoms.append(near)
+
+    return np.concatenate(points).dot(box), np.concatenate(atoms)
+
+
+def find_contacts(xyz, cutoff, box=None):
+    # neighbour search over a KD-tree - returns an (n_contacts, 2) array of
+    # index pairs (i < j, sorted) for points closer than cutoff, taking the
+    # nearest periodic image when the frame's unit cell vectors are given
+    xyz = np.asarray(xyz, dtype=np.float64)
+
+    box = periodic_boxes(box, cutoff)
+
+    if box is None:
+        tree = cKDTree(xyz)
+    elif is_triclinic(box):
+        # the periodic tree only handles rectangular cells - a triclinic cell
+        # is searched with the images of the atoms near its faces instead
+        points, atoms = cell_images(xyz, box, cutoff)
+        tree = cKDTree(points)
+    else:
+        # the periodic tree needs co-ordinates wrapped into [0, L)
+        lengths = np.diag(box)
+        wrapped = np.mod(xyz, lengths)
+        wrapped = np.where(wrapped >= lengths, wrapped - lengths, wrapped)
+        tree = cKDTree(wrapped, boxsize=lengths)
+
+    pairs = tree.query_pairs(cutoff, output_type="ndarray")
+
+    if box is not None and is_triclinic(box) and len(pairs):
+        # pairs of images back to pairs of atoms, each once
+        pairs = np.sort(atoms[pairs], axis=1)
+        pairs = np.unique(pairs[pairs[:, 0] != pairs[:, 1]], axis=0)
+
+    if len(pairs) == 0:
+        return np.zeros((0, 2), dtype=np.intp)
+
+    # query_pairs is inclusive of the cutoff
+    dist = pair_distances(xyz, pairs, box)
+    pairs = pairs[dist < cutoff]
+
+    return pairs[np.lexsort((pairs[:, 1], pairs[:, 0]))]
+
+
+def find_contacts_batch(xyz, cutoff, max_elements=2**22, box=None):
+    # vectorized contact search over a block of frames - xyz has the shape
+    # (n_frames, n_atoms, 3), box the frames' unit cell vectors (n_frames, 3,
+    # 3) if any, and a list of contact pairs (as returned by find_contacts)
+    # is returned for every frame. Distances are evaluated in row blocks so
+    # that at most max_elements pairs are held at once.
+    xyz = np.asarray(xyz, dtype=np.float64)
+    n_frames, n_atoms = xyz.shape[:2]
+
+    box = periodic_boxes(box, cutoff)
+    if box is not None and is_triclinic(box):
+        # triclinic cells compare 27 images of every pair
+        max_elements //= 27
+
+    rows = max(1, max_elements // max(1, n_frames * n_atoms))
+
+    found_frames, found_i, found_j = [], [], []
+
+    for start in range(0, n_atoms - 1, rows):
+        stop = min(start + rows, n_atoms - 1)
+
+        dist = distance_block(xyz, slice(start, stop), slice(start, None), box)
+
+        upper = np.arange(n_atoms - start)[None, :] > np.arange(stop - start)[:, None]
+        f, i, j = np.nonzero((dist < cutoff) & upper)
+
+        found_frames.append(f)
+        found_i.append(i + start)
+        found_j.append(j + start)
+
+    if not found_frames:
+        return [np.zeros((0, 2), dtype=np.intp) for _ in range(n_frames)]
+
+    frames = np.concatenate(found_frames)
+    pairs = np.column_stack((np.concatenate(found_i), np.concatenate(found_j))).astype(np.intp)
+
+    # row blocks are already ordered by (i, j) within each frame
+    order = np.argsort(frames, kind="stable")
+    frames, pairs = frames[order], pairs[order]
 
-    dist = math.sqrt((atom2[0] - atom1[0])**2 + (atom2[1] - atom1[1])**2 + (atom2[2] - atom1[2])**2)
+    bounds = np.searchsorted(frames, np.arange(n_frames + 1))
 
-    return abs(dist)
+    return [pairs[bounds[f]:bounds[f + 1]] for f in range(n_frames)]
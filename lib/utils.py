@@ -1,4 +1,12 @@
-import sys
+import os, sys
+
+def replace_file(source, destination):
+    # atomically moves source over destination (os.replace is not available
+    # in Python 2, where os.rename already replaces files on POSIX systems)
+    if hasattr(os, "replace"):
+        os.replace(source, destination)
+    else:
+        os.rename(source, destination)
 
 def format_seconds(seconds):
     m, s = divmod(seconds, 60)
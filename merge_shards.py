@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+#
+# Combine the results of runs over parts of a trajectory (calc_network.py,
+# calc_correlation.py or contact_map.py with --frame-start/--frame-end or
+# --shard) into the outputs of a single run over all of their frames
+#
+# Script distributed under GNU GPL 3.0
+
+from lib.cli import CLI
+from lib.utils import Logger
+from lib.checkpoint import load_checkpoint
+from lib.store import merge_stores
+from lib.graphs import merge_archives
+
+import os, sys, argparse
+
+
+def load_shards(paths):
+    # returns the kind of the shards and the shards in frame order, checking
+    # that they come from the same tool and cover consecutive frames
+    shards = [load_checkpoint(path) for path in paths]
+
+    kinds = set(shard.get("kind") if isinstance(shard, dict) else None for shard in shards)
+    if len(kinds) != 1 or None in kinds or any(shard["frames"] is None for shard in shards):
+        log.error("The inputs must all be the results of runs of the same tool over a range of frames (.checkpoint files from calc_network.py, .partial files from calc_correlation.py or contact_map.py).\n")
+        sys.exit(1)
+
+    shards.sort(key=lambda shard: shard["frames"][0])
+
+    for previous, shard in zip(shards, shards[1:]):
+        if shard["frames"][0] > previous["frames"][1]:
+            log.error("Frames %d to %d are not covered by any of the shards\n" % (previous["frames"][1] + 1, shard["frames"][0]))
+            sys.exit(1)
+        if shard["frames"][0] < previous["frames"][1]:
+            log.error("The shards for frames %d-%d and %d-%d overlap\n" % (previous["frames"][0] + 1, previous["frames"][1], shard["frames"][0] + 1, shard["frames"][1]))
+            sys.exit(1)
+
+    return kinds.pop(), shards
+
+
+def merged_range(shards):
+    # the range of frames covered by the shards - None if that is the whole
+    # trajectory, so that outputs are named as those of a single run
+    first, stop, total = shards[0]["frames"][0], shards[-1]["frames"][1], shards[0]["frames"][2]
+
+    if first == 0 and stop == total:
+        return None
+
+    return first, stop, total
+
+
+def check_shards(shards, keys):
+    # the shards must have been run with the same settings
+    for shard in shards[1:]:
+        for key in keys:
+            if shard[key] != shards[0][key]:
+                log.error("The shards for frames %d-%d and %d-%d were run with different settings (%s)\n" % (shards[0]["frames"][0] + 1, shards[0]["frames"][1], shard["frames"][0] + 1, shard["frames"][1], key))
+                sys.exit(1)
+
+
+def merge_network(shards, args):
+    from calc_network import output_prefix, load_persistence, collect_summary, save_consensus, save_summary, save_averages
+
+    # the store and graph archive names (and the range itself) differ between
+    # shards, but either all or none of them must have used a store
+    ignored = ("store", "graph_archive", "frame_start", "frame_end", "shard")
+    for shard in shards:
+        shard["common"] = dict((key, value) for key, value in shard["settings"].items() if key not in ignored)
+        shard["store"] = bool(shard["settings"]["store"])
+    check_shards(shards, ("store", "common"))
+
+    for shard in shards:
+        if shard["frame"] != shard["frames"][1] - 1:
+            log.error("The shard for frames %d-%d is incomplete - finish it with --resume first\n" % (shard["frames"][0] + 1, shard["frames"][1]))
+            sys.exit(1)
+
+    settings = shards[0]["settings"]
+    traj_name, metrics = settings["trajectory"], settings["metrics"]
+    prefix = args.prefix or output_prefix(traj_name, merged_range(shards))
+
+    merged = shards[0]
+    for shard in shards[1:]:
+        if merged["averages"] is not None:
+            merged["averages"].merge(shard["averages"])
+        merged["failed"].update(shard["failed"])
+
+    # the contacts and summaries of the shards are read from their logs
+    persistence = None
+    if settings["consensus"]:
+        persistence = load_persistence(shards[0])
+        for shard in shards[1:]:
+            persistence.combine(load_persistence(shard))
+
+    log.info("Merged %d shards (%d frames)\n" % (len(shards), sum(len(shard["times"]) for shard in shards)))
+    if merged["failed"]:
+        log.info("Outputs could not be saved for %d of the frames (see the shards' logs)\n" % len(merged["failed"]))
+
+    if settings["store"]:
+        store = args.store or "%s.store" % prefix
+        log.info("Merging result stores into %s...\n" % store)
+        merge_stores([shard["settings"]["store"] for shard in shards], store, [shard["store_end"] for shard in shards])
+
+    if settings["discard_graphs"]:
+        archive = args.graph_archive or "%s_graphs.mdg" % prefix
+        log.info("Merging graph archives into %s...\n" % archive)
+        merge_archives([shard["settings"]["graph_archive"] or "%s_graphs.mdg" % output_prefix(traj_name, shard["frames"]) for shard in shards], archive, [shard["graphs_end"] for shard in shards])
+
+    if persistence is not None:
+        options = argparse.Namespace(min_occupancy=settings["min_occupancy"], generate_plots=args.generate_plots, xmgrace=False)
+        save_consensus(persistence, prefix, options, metrics)
+
+    if merged["summary"] is not None:
+        log.info("Plotting summary...\n")
+        save_summary(collect_summary(shard["summary"] for shard in shards), prefix)
+
+    if merged["averages"] is not None:
+        save_averages(merged["averages"], prefix)
+
+
+def merge_correlation(shards, args):
+    from calc_correlation import save_correlation, comoment_path
+    from lib.correlation import open_matrix, DCCAccumulator
+
+    check_shards(shards, ("residues",))
+
+    prefix = args.prefix or shards[0]["prefix"]
+    frames = merged_range(shards)
+    if args.prefix is None and frames is not None:
+        prefix = "%s_frames%d-%d" % (prefix, frames[0], frames[1])
+
+    # the shards' co-moments are only read - with --block-size, they are
+    # merged a tile at a time into <prefix>_merged_comoment.npy
+    accumulator = DCCAccumulator(block_size=args.block_size, path=comoment_path(args.block_size, "%s_merged" % prefix))
+    for shard in shards:
+        accumulator.merge(shard["accumulator"])
+
+    log.info("Correlating %d frames...\n" % accumulator.count)
+    correlation = accumulator.correlation(args.block_size, open_matrix("%s.npy" % prefix, len(shards[0]["residues"])))
+    accumulator.discard()
+
+    save_correlation(correlation, args.title or shards[0]["title"], prefix, not args.discard_text)
+
+
+def merge_contacts(shards, args):
+    from contact_map import save_contact_map
+
+    check_shards(shards, ("residue", "chain"))
+
+    # contacts are kept in the order they are first seen, as in a single run
+    contacts = {}
+    for shard in shards:
+        for edge, count in shard["contacts"].items():
+            contacts[edge] = contacts.get(edge, 0) + count
+
+    residue, chain = shards[0]["residue"], shards[0]["chain"]
+    center = "{}.{}".format(residue, chain)
+
+    prefix = args.prefix or residue
+    frames = merged_range(shards)
+    if args.prefix is None and frames is not None:
+        prefix = "%s_frames%d-%d" % (prefix, frames[0], frames[1])
+
+    options = argparse.Namespace(**shards[0]["settings"])
+    save_contact_map(contacts, sum(shard["nframes"] for shard in shards), center, "%s_chain%s_network.csv" % (prefix, chain), "%s_chain%s_contact_map.pdf" % (prefix, chain), options)
+
+
+def main(args):
+    missing = [path for path in args.shards if not os.path.exists(path)]
+    if missing:
+        log.error("Shard not found: %s\n" % ", ".join(missing))
+        sys.exit(1)
+
+    kind, shards = load_shards(args.shards)
+
+    if kind == "network":
+        merge_network(shards, args)
+    elif kind == "correlation":
+        merge_correlation(shards, args)
+    elif kind == "contacts":
+        merge_contacts(shards, args)
+
+
+log = Logger()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("shards", help="Results of the runs over parts of the trajectory - the .checkpoint files of calc_network.py or the .partial files of calc_correlation.py/contact_map.py", nargs="+")
+    parser.add_argument("--prefix", help="Prefix used to name outputs (default: that of a single run over the same frames)", default=None)
+    parser.add_argument("--title", help="Title of the correlation heat map (default: that of the shards)", default=None)
+    parser.add_argument("--block-size", help="Number of rows and columns of the tiles the merged correlation matrix is written in - the merged co-moments are then memory-mapped from <prefix>_merged_comoment.npy rather than held in memory (default: the whole matrix at once, in memory)", default=None, type=int)
+    parser.add_argument("--discard-text", help="Only save the merged correlation matrix in binary (<prefix>.npy), not as text", action='store_true', default=False)
+    parser.add_argument("--generate-plots", help="Plot the BC/L of the consensus network (calc_network.py --consensus)", action='store_true', default=False)
+    parser.add_argument("--store", help="Result store the shards' stores are merged into (default: <prefix>.store)", default=None)
+    parser.add_argument("--graph-archive", help="Graph archive the shards' archives are merged into (default: <prefix>_graphs.mdg)", default=None)
+
+    CLI(parser, main, log)
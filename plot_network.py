@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+#
+# Plot previously calculated per-residue network measurements (BC, avg L or
+# their deltas) - one figure per frame and/or a single summary figure
+#
+# Script distributed under GNU GPL 3.0
+
+from lib.cli import CLI
+from lib.utils import Logger
+from lib.store import iter_data
+from lib.plots import PlotQueue, plot_nodes, plot_summary
+
+import numpy as np
+
+import argparse
+
+
+def main(args):
+    if not args.frame_plots and not args.summary_plot:
+        log.error("At least one of the --frame-plots or --summary-plot flags must be set.\n")
+        return
+
+    x_label = args.x_label or "Node Indices"
+    y_label = args.y_label or args.data_type
+
+    times, summary = [], []
+
+    with PlotQueue(args.workers) as plots:
+        for i, (title, frame, time, values) in enumerate(iter_data(args.data)):
+            log.info("Plotting %d\r" % (i + 1))
+
+            values = np.ravel(values)
+
+            if args.frame_plots:
+                plots.submit(plot_nodes, values, "%s.png" % title, "%s %s" % (title, y_label), x_label, y_label, zero_line="delta" in args.data_type.lower())
+
+            if args.summary_plot:
+                times.append(i if time is None else time)
+                summary.append(values)
+
+    if summary:
+        plot_summary(np.vstack(summary), "%s_summary.png" % args.prefix, args.title or "%s %s" % (args.prefix, args.data_type), times, x_label, y_label)
+
+    log.info("\n")
+
+
+log = Logger()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("--data", help="The .dat files (or result store datasets, e.g. wt.store:bc) that will be plotted", nargs="*")
+    parser.add_argument("--data-type", help="Type of data - BC/delta-BC/L/delta-L", default="BC")
+    parser.add_argument("--prefix", help="Prefix used to name the summary figure", default="network")
+    parser.add_argument("--frame-plots", help="Plot each frame in its own figure (<input name>.png)", action='store_true', default=False)
+    parser.add_argument("--summary-plot", help="Plot all frames in a single figure (<prefix>_summary.png)", action='store_true', default=False)
+    parser.add_argument("--workers", help="Number of processes used to render the --frame-plots figures (default: 0 - render in the main process)", default=0, type=int)
+    parser.add_argument("--x-label", help="Label for x-axis (use $\Delta$ for delta sign)", default=None)
+    parser.add_argument("--y-label", help="Label for y-axis (use $\Delta$ for delta sign)", default=None)
+    parser.add_argument("--title", help="Title of the summary figure", default=None)
+
+    CLI(parser, main, log)
@@ -19,7 +19,7 @@ from math import log10, floor, sqrt
 from lib import sdrms
 from lib.cli import CLI
 from lib.utils import Logger
-from lib.trajectory import load_trajectory
+from lib.trajectory import load_trajectory, load_topology, select_nodes, CoordinateIterator, CoordinateCache
 
 
 def round_sig(x, sig=2):
@@ -27,16 +27,14 @@ def round_sig(x, sig=2):
 
 
 def trajectory_to_array(traj, totalframes, totalres):
+    # the frames only hold the CA atoms (see main) - rows are filled a chunk
+    # of frames at a time
     trajectory = numpy.zeros((totalframes, totalres*3))
 
-    for row, frame in enumerate(traj):
-        top = frame.topology
-
-        col = 0
-        for atom_index, atom in enumerate(top.atoms):
-            if atom.name == "CA":
-                trajectory[row,col:col+3] = frame.xyz[0,atom_index]*10
-                col += 3
+    row = 0
+    for xyz, _, _ in CoordinateIterator(traj).chunks():
+        trajectory[row:row + len(xyz)] = xyz.reshape(len(xyz), totalres*3)*10
+        row += len(xyz)
 
     return trajectory
 
@@ -72,11 +70,15 @@ def main(args):
 
     log.info("Loading trajectory...\n")
 
+    # only the CA co-ordinates are read from the trajectory
+    atoms, _ = select_nodes(load_topology(args.trajectory, args.topology), "name CA")
+    cache = CoordinateCache(args.cache_dir, int(args.cache_size * 2**30)) if args.cache_dir else None
+
     if args.num_frames:
-        traj, totalframes = load_trajectory(args.trajectory, args.topology, args.step, True)
+        traj, totalframes = load_trajectory(args.trajectory, args.topology, args.step, True, atom_indices=atoms, cache=cache)
         totalframes = args.num_frames
     else:
-        traj, totalframes = load_trajectory(args.trajectory, args.topology, args.step, False)
+        traj, totalframes = load_trajectory(args.trajectory, args.topology, args.step, False, atom_indices=atoms, cache=cache)
 
     totalres = initial.n_residues
 
@@ -264,6 +266,8 @@ if __name__ == "__main__":
     parser.add_argument("--initial", help="Initial state co-ordinate file (default: generated from first frame of trajectory)", default=None)
     parser.add_argument("--final", help="Final state co-ordinate file (must be provided)")
     parser.add_argument("--perturbations", help="Number of perturbations (default: 250)", type=int, default=250)
+    parser.add_argument("--cache-dir", help="Directory of a co-ordinate cache shared by the MD-TASK tools - the co-ordinates of the selected atoms are read from the trajectory once and memory-mapped from the cache by later runs (default: no cache)", default=None)
+    parser.add_argument("--cache-size", help="Maximum size of the --cache-dir cache in GB - the least recently used trajectories are removed (default: 10)", default=10, type=float)
     parser.add_argument("--num-frames", help="The number of frames in the trajectory (provides improved performance for large trajectories that cannot be loaded into memory)", type=int, default=None)
     parser.add_argument("--aln", help="Restrict N-Terminal alignment", action="store_true")
     parser.add_argument("--prefix", help="Prefix for CSV output file (default: result)", default="result")
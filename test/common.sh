@@ -0,0 +1,34 @@
+#!/bin/bash
+#
+# Helpers shared by the test scripts (source from an out_* directory)
+
+BIN_DIR=../..
+
+run() {
+    # runs an MD-TASK command, failing the test if it exits with an error or
+    # logs one
+    "$@" > run.log 2>&1
+    status=$?
+
+    cat run.log
+
+    if [ $status -ne 0 ] || grep -q "ERROR::" run.log; then
+        echo "FAILED: $*"
+        exit 1
+    fi
+}
+
+same() {
+    # fails the test unless the files are byte-for-byte identical
+    for path in "$1" "$2"; do
+        if [ ! -s "$path" ]; then
+            echo "FAILED: $path is missing or empty"
+            exit 1
+        fi
+    done
+
+    if ! cmp -s "$1" "$2"; then
+        echo "FAILED: $1 and $2 differ"
+        exit 1
+    fi
+}
@@ -6,4 +6,13 @@
 ./test_CM.sh
 ./test_DCC.sh
 ./test_PRS.sh
-
+./test_store.sh
+./test_network_baseline.sh
+./test_contacts.sh
+./test_BC_kernels.sh
+./test_incremental.sh
+./test_DCC_stream.sh
+./test_shards.sh
+./test_plots.sh
+./test_graphs.sh
+./test_resume.sh
@@ -0,0 +1,62 @@
+#!/bin/bash
+
+
+mkdir out_BC_kernels
+cd out_BC_kernels
+
+source ../common.sh
+
+cp $BIN_DIR/example/* .
+
+echo ""
+echo "#### BETWEENNESS CENTRALITY - CSR AND APPROXIMATE BC ####"
+echo ""
+
+PREFIX=wt
+
+run python $BIN_DIR/calc_network.py --topology $PREFIX.pdb --threshold 7.0 --step 100 --calc-BC --discard-graphs $PREFIX.dcd
+mkdir networkx
+mv ${PREFIX}_*_bc.dat networkx
+
+for options in "--bc-backend csr" "--bc-backend csr --batch-contacts --chunk-size 4" "--bc-approx 100000 --seed 1"; do
+    rm -f ${PREFIX}_*_bc.dat ${PREFIX}_*_bc_err.dat
+    run python $BIN_DIR/calc_network.py --topology $PREFIX.pdb --threshold 7.0 --step 100 --calc-BC --discard-graphs $options $PREFIX.dcd
+
+    # csr BC agrees with networkx to rounding, and so does BC sampled from
+    # every node (with no error)
+    python - << END
+import sys, glob, os
+import numpy as np
+
+for path in sorted(glob.glob("networkx/*_bc.dat")):
+    name = os.path.basename(path)
+
+    if not os.path.exists(name) or not np.allclose(np.loadtxt(path), np.loadtxt(name), rtol=1e-9, atol=1e-9):
+        print("FAILED: $options - %s differs from networkx" % name)
+        sys.exit(1)
+
+    error = name.replace("_bc.dat", "_bc_err.dat")
+    if os.path.exists(error) and np.any(np.loadtxt(error)):
+        print("FAILED: $options - %s is not zero" % error)
+        sys.exit(1)
+
+print("OK: $options")
+END
+    [ $? -eq 0 ] || exit 1
+done
+
+# with a sample of the nodes, every frame has an estimate and its error, and
+# the same seed gives the same estimate
+rm -f ${PREFIX}_*_bc.dat ${PREFIX}_*_bc_err.dat
+run python $BIN_DIR/calc_network.py --topology $PREFIX.pdb --threshold 7.0 --step 100 --calc-BC --discard-graphs --bc-approx 20 --seed 1 $PREFIX.dcd
+mkdir seeded
+mv ${PREFIX}_*_bc.dat ${PREFIX}_*_bc_err.dat seeded
+
+run python $BIN_DIR/calc_network.py --topology $PREFIX.pdb --threshold 7.0 --step 100 --calc-BC --discard-graphs --bc-approx 20 --seed 1 --workers 2 $PREFIX.dcd
+
+for path in networkx/*_bc.dat; do
+    name=$(basename $path)
+    same seeded/$name $name
+    same seeded/${name%.dat}_err.dat ${name%.dat}_err.dat
+done
+echo "OK: --bc-approx 20 --seed 1"
@@ -0,0 +1,76 @@
+#!/bin/bash
+
+
+mkdir out_DCC_stream
+cd out_DCC_stream
+
+source ../common.sh
+
+cp $BIN_DIR/example/* .
+
+echo ""
+echo "#### DYNAMIC CROSS CORRELATION - STREAMED, TILED AND WINDOWED ####"
+echo ""
+
+PREFIX=wt
+
+run python $BIN_DIR/calc_correlation.py --step 20 --prefix in_memory --trajectory $PREFIX.dcd --topology $PREFIX.pdb
+run python $BIN_DIR/calc_correlation.py --step 20 --prefix tiled --block-size 7 --trajectory $PREFIX.dcd --topology $PREFIX.pdb
+run python $BIN_DIR/calc_correlation.py --step 20 --prefix chunked --chunk-size 3 --trajectory $PREFIX.dcd --topology $PREFIX.pdb
+run python $BIN_DIR/calc_correlation.py --step 20 --prefix streamed --lazy-load --chunk-size 3 --trajectory $PREFIX.dcd --topology $PREFIX.pdb
+run python $BIN_DIR/calc_correlation.py --step 20 --prefix streamed_tiled --block-size 7 --lazy-load --chunk-size 3 --prefetch 2 --trajectory $PREFIX.dcd --topology $PREFIX.pdb
+run python $BIN_DIR/calc_correlation.py --step 20 --prefix windows --window 6 --window-step 4 --block-size 7 --lazy-load --chunk-size 5 --trajectory $PREFIX.dcd --topology $PREFIX.pdb
+run python $BIN_DIR/calc_correlation.py --step 20 --prefix gapped_windows --window 3 --window-step 5 --chunk-size 4 --trajectory $PREFIX.dcd --topology $PREFIX.pdb
+
+# every way of calculating the matrix agrees with the correlation of the
+# frames calculated directly from its definition, and each window with the correlation of its own frames
+python - << END
+import sys, os
+sys.path.insert(0, "$BIN_DIR")
+
+import numpy as np
+
+from calc_correlation import parse_traj
+
+def reference(coords):
+    # C(i, j) = <dri.drj> / sqrt(<dri.dri><drj.drj>)
+    deltas = coords - coords.mean(axis=0)
+    products = np.einsum("tik,tjk->ij", deltas, deltas, dtype=np.float64)
+    magnitude = np.sqrt(np.diag(products))
+
+    return products / np.outer(magnitude, magnitude)
+
+coords, _ = parse_traj("$PREFIX.dcd", "$PREFIX.pdb", 20)
+coords = coords.astype(np.float64)
+expected = reference(coords)
+
+failed = False
+def check(name, found, reference):
+    global failed
+    ok = found.shape == reference.shape and np.allclose(found, reference, atol=1e-8)
+    failed = failed or not ok
+    print("%s: %s" % ("OK" if ok else "FAILED", name))
+
+for prefix in ("in_memory", "tiled", "chunked", "streamed", "streamed_tiled"):
+    check("%s.npy" % prefix, np.load("%s.npy" % prefix), expected)
+    check("%s.txt" % prefix, np.loadtxt("%s.txt" % prefix), expected)
+
+for prefix, window, step in (("windows", 6, 4), ("gapped_windows", 3, 5)):
+    matrices = np.load("%s_windows.npy" % prefix)
+    summary = np.loadtxt("%s_windows.txt" % prefix, ndmin=2)
+
+    starts = list(range(0, len(coords) - window + 1, step))
+    check("%s_windows.txt" % prefix, summary[:, 1], np.array(starts, dtype=float))
+
+    for index, start in enumerate(starts):
+        check("%s window %d" % (prefix, index), matrices[index], reference(coords[start:start + window]))
+
+# the memory-mapped co-moments are removed once the matrix has been written
+for path in ("streamed_tiled_comoment.npy", "windows_windows_comoment.npy"):
+    if os.path.exists(path):
+        print("FAILED: %s was left behind" % path)
+        failed = True
+
+sys.exit(1 if failed else 0)
+END
+[ $? -eq 0 ] || exit 1
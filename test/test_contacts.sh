@@ -0,0 +1,67 @@
+#!/bin/bash
+
+
+mkdir out_contacts
+cd out_contacts
+
+source ../common.sh
+
+cp $BIN_DIR/example/* .
+
+echo ""
+echo "#### CONTACTS - PERIODIC AND TRICLINIC CELLS ####"
+echo ""
+
+# the KD-tree and batched searches against every pair of atoms and the 27
+# nearest images of the cell
+python - << END
+import sys
+sys.path.insert(0, "$BIN_DIR")
+
+import itertools
+import numpy as np
+
+from lib.trajectory import find_contacts, find_contacts_batch
+
+def brute_force(xyz, cutoff, box=None):
+    i, j = np.triu_indices(len(xyz), 1)
+    diff = xyz[j] - xyz[i]
+
+    if box is None:
+        dist = np.linalg.norm(diff, axis=1)
+    else:
+        frac = diff.dot(np.linalg.inv(box))
+        diff = (frac - np.round(frac)).dot(box)
+        shifts = np.array(list(itertools.product((-1, 0, 1), repeat=3))).dot(box)
+        dist = np.linalg.norm(diff[:, None, :] + shifts[None, :, :], axis=2).min(axis=1)
+
+    return np.column_stack((i, j))[dist < cutoff]
+
+random = np.random.RandomState(0)
+cells = {
+    "no cell": None,
+    "rectangular": np.diag([3.0, 3.5, 4.0]),
+    "triclinic": np.array([[3.0, 0.0, 0.0], [0.8, 3.2, 0.0], [-0.6, 0.7, 3.6]])
+}
+
+failed = False
+for name, box in sorted(cells.items()):
+    frames = random.uniform(-1, 5, size=(4, 300, 3))
+    boxes = None if box is None else np.repeat(box[None], len(frames), axis=0)
+
+    batch = find_contacts_batch(frames, 0.7, max_elements=5000, box=boxes)
+    ok = True
+
+    for xyz, batched in zip(frames, batch):
+        expected = brute_force(xyz, 0.7, box)
+        found = find_contacts(xyz, 0.7, box)
+
+        if not np.array_equal(found, expected) or not np.array_equal(batched, expected):
+            ok = False
+
+    failed = failed or not ok
+    print("%s: %s" % ("OK" if ok else "FAILED", name))
+
+sys.exit(1 if failed else 0)
+END
+[ $? -eq 0 ] || exit 1
@@ -0,0 +1,68 @@
+#!/bin/bash
+
+
+mkdir out_graphs
+cd out_graphs
+
+source ../common.sh
+
+cp $BIN_DIR/example/* .
+
+echo ""
+echo "#### GRAPH ARCHIVE - EXPORT TO GML AND GRAPHML ####"
+echo ""
+
+PREFIX=wt
+
+run python $BIN_DIR/calc_network.py --topology $PREFIX.pdb --threshold 7.0 --step 100 --calc-BC $PREFIX.dcd
+run python $BIN_DIR/calc_network.py --topology $PREFIX.pdb --threshold 7.0 --step 100 --calc-BC --compress-graphs --graph-archive compressed.mdg $PREFIX.dcd
+
+run python $BIN_DIR/convert_graphs.py ${PREFIX}_graphs.mdg
+run python $BIN_DIR/convert_graphs.py --prefix compressed compressed.mdg
+run python $BIN_DIR/convert_graphs.py --prefix single --formats gml --frames 1 ${PREFIX}_graphs.mdg
+
+# the exported networks hold the contacts of each frame, found directly from
+# the trajectory
+python - << END
+import sys, glob
+sys.path.insert(0, "$BIN_DIR")
+
+import mdtraj as md
+import networkx as nx
+
+from lib.graphs import GraphArchive
+from calc_network import construct_graph
+
+def edge_set(graph):
+    return set(tuple(sorted((int(i), int(j)))) for i, j in graph.edges())
+
+traj = md.load("$PREFIX.dcd", top="$PREFIX.pdb", stride=100)
+
+failed = False
+def check(name, ok):
+    global failed
+    failed = failed or not ok
+    print("%s: %s" % ("OK" if ok else "FAILED", name))
+
+for path, prefix in (("${PREFIX}_graphs.mdg", "$PREFIX"), ("compressed.mdg", "compressed")):
+    with GraphArchive(path) as archive:
+        check("%s holds %d frames" % (path, len(traj)), archive.frames() == list(range(len(traj))))
+
+        for frame in archive.frames():
+            expected = construct_graph(traj[frame], threshold=7.0, save_graph=False)
+            name = "%s_%d_graph" % (prefix, archive.time(frame))
+
+            gml = nx.read_gml("%s.gml" % name, label="id")
+            graphml = nx.read_graphml("%s.graphml" % name, node_type=int)
+
+            for found, fmt in ((gml, "gml"), (graphml, "graphml")):
+                check("%s.%s" % (name, fmt), found.number_of_nodes() == expected.number_of_nodes() and edge_set(found) == edge_set(expected))
+
+with GraphArchive("${PREFIX}_graphs.mdg") as archive:
+    expected = ["single_%d_graph.gml" % archive.time(1)]
+
+check("--frames 1 exports %s" % expected[0], sorted(glob.glob("single_*")) == expected)
+
+sys.exit(1 if failed else 0)
+END
+[ $? -eq 0 ] || exit 1
@@ -0,0 +1,32 @@
+#!/bin/bash
+
+
+mkdir out_incremental
+cd out_incremental
+
+source ../common.sh
+
+cp $BIN_DIR/example/* .
+
+echo ""
+echo "#### INCREMENTAL SHORTEST PATHS ####"
+echo ""
+
+PREFIX=wt
+
+# consecutive frames (--step 1) change few contacts, so most are updated
+# from the previous frame rather than recalculated
+run python $BIN_DIR/calc_network.py --topology $PREFIX.pdb --threshold 7.0 --step 1 --frame-end 40 --calc-BC --calc-L --discard-graphs --bc-backend csr $PREFIX.dcd
+mkdir full
+mv ${PREFIX}_*.dat full
+
+for changes in 20 1000; do
+    rm -f ${PREFIX}_*.dat
+    run python $BIN_DIR/calc_network.py --topology $PREFIX.pdb --threshold 7.0 --step 1 --frame-end 40 --calc-BC --calc-L --discard-graphs --bc-backend csr --incremental --max-edge-changes $changes $PREFIX.dcd
+
+    # path lengths are integers, so the updates must give exactly the same L
+    for path in full/*.dat; do
+        same $path $(basename $path)
+    done
+    echo "OK: --incremental --max-edge-changes $changes"
+done
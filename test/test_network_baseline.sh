@@ -0,0 +1,98 @@
+#!/bin/bash
+
+
+mkdir out_baseline
+cd out_baseline
+
+source ../common.sh
+
+cp $BIN_DIR/example/* .
+
+echo ""
+echo "#### BC AND L - SAME OUTPUT AS THE ORIGINAL PAIRWISE LOOP ####"
+echo ""
+
+PREFIX=wt
+
+# the networks, BC and L of every frame as the original calc_network.py
+# calculated them (pairwise distances, networkx) - written to ref_<time>_*.dat
+python - << END
+import numpy as np
+import networkx as nx
+import mdtraj as md
+
+traj = md.load("$PREFIX.dcd", top="$PREFIX.pdb", stride=100)
+atoms = traj.topology.select("(name CB and protein) or (name CA and resname GLY)")
+i, j = np.triu_indices(len(atoms), 1)
+
+for frame in traj:
+    xyz = frame.xyz[0, atoms]
+    squares = (xyz[j] - xyz[i])**2
+    dist = np.sqrt(((squares[:, 0] + squares[:, 1]) + squares[:, 2]).astype(np.float64)) * 10
+
+    graph = nx.Graph()
+    graph.add_nodes_from(range(len(atoms)))
+    graph.add_edges_from(zip(i[dist < 7.0].tolist(), j[dist < 7.0].tolist()))
+
+    prefix = "ref_%d" % frame.time[0]
+
+    bc = nx.betweenness_centrality(graph, normalized=False)
+    np.savetxt("%s_bc.dat" % prefix, np.asarray(list(bc.values())).reshape(1, len(atoms)))
+
+    paths = dict(nx.all_pairs_shortest_path_length(graph))
+    L = np.zeros((len(atoms), len(atoms)))
+    for a in range(len(atoms)):
+        for b in range(len(atoms)):
+            L[a, b] = paths[a][b]
+
+    np.savetxt("%s_L.dat" % prefix, L)
+    np.savetxt("%s_avg_L.dat" % prefix, (np.sum(L, axis=0) / (len(atoms) - 1)).reshape(1, len(atoms)))
+END
+
+check() {
+    for ref in ref_*_bc.dat; do
+        time=${ref#ref_}
+        time=${time%_bc.dat}
+
+        for name in bc L avg_L; do
+            same ref_${time}_${name}.dat ${PREFIX}_${time}_${name}.dat
+        done
+    done
+}
+
+run python $BIN_DIR/calc_network.py --topology $PREFIX.pdb --threshold 7.0 --step 100 --calc-BC --calc-L --discard-graphs $PREFIX.dcd
+check
+echo "OK: calc_network.py"
+
+rm ${PREFIX}_*.dat
+run python $BIN_DIR/calc_network.py --topology $PREFIX.pdb --threshold 7.0 --step 100 --calc-BC --calc-L --discard-graphs --batch-contacts --chunk-size 4 $PREFIX.dcd
+check
+echo "OK: calc_network.py --batch-contacts"
+
+rm ${PREFIX}_*.dat
+run python $BIN_DIR/calc_network.py --topology $PREFIX.pdb --threshold 7.0 --step 100 --calc-BC --calc-L --discard-graphs --workers 2 $PREFIX.dcd
+check
+echo "OK: calc_network.py --workers"
+
+rm ${PREFIX}_*.dat
+run python $BIN_DIR/calc_network.py --topology $PREFIX.pdb --threshold 7.0 --step 100 --calc-BC --calc-L --discard-graphs --lazy-load --chunk-size 3 $PREFIX.dcd
+check
+echo "OK: calc_network.py --lazy-load"
+
+# the first run adds the trajectory to the cache, the second reads it back
+rm ${PREFIX}_*.dat
+run python $BIN_DIR/calc_network.py --topology $PREFIX.pdb --threshold 7.0 --step 100 --calc-BC --calc-L --discard-graphs --cache-dir cache $PREFIX.dcd
+rm ${PREFIX}_*.dat
+run python $BIN_DIR/calc_network.py --topology $PREFIX.pdb --threshold 7.0 --step 100 --calc-BC --calc-L --discard-graphs --cache-dir cache $PREFIX.dcd
+check
+echo "OK: calc_network.py --cache-dir"
+
+rm ${PREFIX}_*.dat
+run python $BIN_DIR/calc_network.py --topology $PREFIX.pdb --threshold 7.0 --step 100 --calc-BC --calc-L --discard-graphs --lazy-load --chunk-size 3 --prefetch 2 $PREFIX.dcd
+check
+echo "OK: calc_network.py --lazy-load --prefetch"
+
+if ls *.checkpoint > /dev/null 2>&1; then
+    echo "FAILED: a checkpoint was written without --checkpoint-interval"
+    exit 1
+fi
@@ -0,0 +1,64 @@
+#!/bin/bash
+
+
+mkdir out_plots
+cd out_plots
+
+source ../common.sh
+
+cp $BIN_DIR/example/* .
+
+echo ""
+echo "#### PLOTS - FRAME AND SUMMARY FIGURES ####"
+echo ""
+
+PREFIX=wt
+NORM=plusone
+
+expect() {
+    # fails the test unless every given figure was written
+    for path in "$@"; do
+        if [ ! -s "$path" ]; then
+            echo "FAILED: $path is missing or empty"
+            exit 1
+        fi
+    done
+}
+
+run python $BIN_DIR/calc_network.py --topology $PREFIX.pdb --threshold 7.0 --step 100 --calc-BC --calc-L --discard-graphs --generate-plots --plot-workers 2 --summary-plot $PREFIX.dcd
+
+for path in ${PREFIX}_*_bc.dat; do
+    expect ${path%_bc.dat}_BC.png ${path%_bc.dat}_L.png
+done
+expect ${PREFIX}_BC_summary.png ${PREFIX}_L_summary.png
+echo "OK: calc_network.py --generate-plots --plot-workers --summary-plot"
+
+run python $BIN_DIR/plot_network.py --data ${PREFIX}_*_bc.dat --data-type BC --prefix ${PREFIX}_bc --frame-plots --summary-plot --workers 2
+
+for path in ${PREFIX}_*_bc.dat; do
+    expect ${path%.dat}.png
+done
+expect ${PREFIX}_bc_summary.png
+echo "OK: plot_network.py --frame-plots --summary-plot --workers"
+
+mv ${PREFIX}_0_bc.dat ref_${PREFIX}_bc.dat
+rm -f *.png
+
+# the summary is named after the reference, or after --prefix
+run python $BIN_DIR/calc_delta_BC.py --normalize --normalization-mode ${NORM} --generate-plots --plot-workers 2 --summary-plot --reference ref_${PREFIX}_bc.dat --alternatives ${PREFIX}_*_bc.dat
+
+for path in ${PREFIX}_*_bc.dat; do
+    expect ${path%.dat}_${NORM}_delta_BC.png
+done
+expect ref_${PREFIX}_bc_${NORM}_delta_BC_summary.png
+echo "OK: calc_delta_BC.py --summary-plot"
+
+rm -f *.png
+run python $BIN_DIR/calc_delta_BC.py --normalize --normalization-mode ${NORM} --summary-plot --prefix ${PREFIX} --reference ref_${PREFIX}_bc.dat --alternatives ${PREFIX}_*_bc.dat
+
+expect ${PREFIX}_${NORM}_delta_BC_summary.png
+if [ "$(ls *.png)" != "${PREFIX}_${NORM}_delta_BC_summary.png" ]; then
+    echo "FAILED: calc_delta_BC.py --summary-plot --prefix wrote $(ls *.png | tr '\n' ' ')"
+    exit 1
+fi
+echo "OK: calc_delta_BC.py --summary-plot --prefix"
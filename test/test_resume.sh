@@ -0,0 +1,60 @@
+#!/bin/bash
+
+
+mkdir out_resume
+cd out_resume
+
+source ../common.sh
+
+cp $BIN_DIR/example/* .
+
+echo ""
+echo "#### RESUME - CONTINUE AN INTERRUPTED RUN FROM ITS CHECKPOINT ####"
+echo ""
+
+PREFIX=wt
+OPTIONS="--topology $PREFIX.pdb --threshold 7.0 --step 20 --calc-BC --calc-L --chunk-size 1 --checkpoint-interval 2 --store $PREFIX.store"
+
+# an uninterrupted run, in its own directory
+mkdir single
+cd single
+cp ../$PREFIX.* .
+run python ../$BIN_DIR/calc_network.py $OPTIONS $PREFIX.dcd
+cd ..
+
+# the run is interrupted after the 5th frame, one frame after its last
+# checkpoint, so that frame is written to the store and graph archive twice
+python - << END
+import sys, runpy
+sys.path.insert(0, "$BIN_DIR")
+
+from lib import trajectory
+
+chunks = trajectory.CoordinateIterator.chunks
+def interrupted(self):
+    for i, chunk in enumerate(chunks(self)):
+        if i == 5:
+            raise KeyboardInterrupt
+        yield chunk
+
+trajectory.CoordinateIterator.chunks = interrupted
+
+sys.argv = ["calc_network.py"] + "$OPTIONS".split() + ["$PREFIX.dcd"]
+try:
+    runpy.run_path("$BIN_DIR/calc_network.py", run_name="__main__")
+except KeyboardInterrupt:
+    print("OK: interrupted after 5 frames")
+    sys.exit(0)
+
+print("FAILED: the run was not interrupted")
+sys.exit(1)
+END
+[ $? -eq 0 ] || exit 1
+
+run python $BIN_DIR/calc_network.py $OPTIONS --resume $PREFIX.dcd
+
+# the frames written after the checkpoint are dropped when resuming
+for path in $PREFIX.store ${PREFIX}_graphs.mdg; do
+    same single/$path $path
+done
+echo "OK: calc_network.py --resume"
@@ -0,0 +1,100 @@
+#!/bin/bash
+
+
+mkdir out_shards
+cd out_shards
+
+source ../common.sh
+
+cp $BIN_DIR/example/* .
+
+echo ""
+echo "#### SHARDS - MERGED RESULTS OF RUNS OVER PARTS OF THE TRAJECTORY ####"
+echo ""
+
+PREFIX=wt
+
+# a single run over all frames, in its own directory
+mkdir single
+cd single
+cp ../$PREFIX.* .
+run python ../$BIN_DIR/calc_network.py --topology $PREFIX.pdb --threshold 7.0 --step 20 --calc-BC --calc-L --average --delta-normalization plusone --summary-plot --store $PREFIX.store $PREFIX.dcd
+run python ../$BIN_DIR/calc_network.py --topology $PREFIX.pdb --threshold 7.0 --step 20 --calc-BC --calc-L --consensus --discard-graphs $PREFIX.dcd
+run python ../$BIN_DIR/calc_correlation.py --step 20 --prefix corr --trajectory $PREFIX.dcd --topology $PREFIX.pdb
+cd ..
+
+for shard in 1/3 2/3 3/3; do
+    name=${shard%/*}
+    run python $BIN_DIR/calc_network.py --topology $PREFIX.pdb --threshold 7.0 --step 20 --calc-BC --calc-L --average --delta-normalization plusone --summary-plot --store ${PREFIX}_${name}.store --shard $shard $PREFIX.dcd
+    run python $BIN_DIR/calc_correlation.py --step 20 --prefix corr --trajectory $PREFIX.dcd --topology $PREFIX.pdb --block-size 7 --shard $shard
+done
+
+run python $BIN_DIR/merge_shards.py ${PREFIX}_frames*.checkpoint
+run python $BIN_DIR/merge_shards.py --block-size 5 corr_frames*.partial
+
+mkdir consensus
+cd consensus
+cp ../$PREFIX.* .
+for shard in 1/2 2/2; do
+    run python ../$BIN_DIR/calc_network.py --topology $PREFIX.pdb --threshold 7.0 --step 20 --calc-BC --calc-L --consensus --discard-graphs --shard $shard $PREFIX.dcd
+done
+run python ../$BIN_DIR/merge_shards.py ${PREFIX}_frames*.checkpoint
+cd ..
+
+python - << END
+import sys, glob
+sys.path.insert(0, "$BIN_DIR")
+
+import numpy as np
+
+from lib.store import ResultStore
+from lib.graphs import GraphArchive
+
+failed = False
+def check(name, ok):
+    global failed
+    failed = failed or not ok
+    print("%s: %s" % ("OK" if ok else "FAILED", name))
+
+for name in ("BC", "L", "delta_BC", "delta_L"):
+    for stat in ("avg", "std_dev"):
+        path = "${PREFIX}_%s_%s.dat" % (name, stat)
+        check(path, np.allclose(np.loadtxt(path), np.loadtxt("single/" + path)))
+
+for path in ("${PREFIX}_consensus_edges.dat", "${PREFIX}_consensus_bc.dat", "${PREFIX}_consensus_avg_L.dat"):
+    check(path, np.allclose(np.loadtxt("consensus/" + path), np.loadtxt("single/" + path)))
+
+with ResultStore("${PREFIX}.store") as merged, ResultStore("single/${PREFIX}.store") as single:
+    for name in ("bc", "L", "avg_L"):
+        check("${PREFIX}.store:%s" % name, merged.frames(name) == single.frames(name) and np.array_equal(merged.read_all(name), single.read_all(name)))
+
+with GraphArchive("${PREFIX}_graphs.mdg") as merged, GraphArchive("single/${PREFIX}_graphs.mdg") as single:
+    same = merged.frames() == single.frames()
+    for frame in single.frames() if same else ():
+        (n, edges), (m, expected) = merged.read(frame), single.read(frame)
+        same = same and n == m and np.array_equal(edges, expected)
+    check("${PREFIX}_graphs.mdg", same)
+
+check("corr.npy", np.allclose(np.load("corr.npy"), np.load("single/corr.npy"), atol=1e-8))
+check("corr_merged_comoment.npy removed", not glob.glob("corr_merged_comoment.npy"))
+
+sys.exit(1 if failed else 0)
+END
+[ $? -eq 0 ] || exit 1
+
+# shards that did and did not use a result store cannot be merged
+mkdir mixed
+cd mixed
+cp ../$PREFIX.* .
+run python ../$BIN_DIR/calc_network.py --topology $PREFIX.pdb --threshold 7.0 --step 20 --calc-BC --store ${PREFIX}_1.store --shard 1/2 $PREFIX.dcd
+run python ../$BIN_DIR/calc_network.py --topology $PREFIX.pdb --threshold 7.0 --step 20 --calc-BC --shard 2/2 $PREFIX.dcd
+
+python ../$BIN_DIR/merge_shards.py ${PREFIX}_frames*.checkpoint > merge.log 2>&1
+status=$?
+cat merge.log
+
+if [ $status -ne 1 ] || ! grep -q "ERROR::.*different settings (store)" merge.log; then
+    echo "FAILED: shards with and without --store were merged"
+    exit 1
+fi
+echo "OK: shards with and without --store are rejected"
@@ -0,0 +1,99 @@
+#!/bin/bash
+
+
+mkdir out_store
+cd out_store
+
+source ../common.sh
+
+cp $BIN_DIR/example/* .
+
+echo ""
+echo "#### RESULT STORE - RERUN WITH A DIFFERENT STEP ####"
+echo ""
+
+PREFIX=wt
+
+run python $BIN_DIR/calc_network.py --topology $PREFIX.pdb --threshold 7.0 --step 50 --calc-BC --store ${PREFIX}.store $PREFIX.dcd
+run python $BIN_DIR/calc_network.py --topology $PREFIX.pdb --threshold 7.0 --step 100 --calc-BC --store ${PREFIX}.store $PREFIX.dcd
+
+# a run without --resume replaces the store and the graph archive, so only
+# the frames of the second run may be left in them
+python - << END
+import sys
+sys.path.insert(0, "$BIN_DIR")
+
+from lib.store import ResultStore
+from lib.graphs import GraphArchive
+from lib.trajectory import count_frames
+
+expected = -(-count_frames("$PREFIX.dcd") // 100)
+
+with ResultStore("${PREFIX}.store") as store:
+    found = {"${PREFIX}.store": len(store.frames("bc"))}
+
+with GraphArchive("${PREFIX}_graphs.mdg") as graphs:
+    found["${PREFIX}_graphs.mdg"] = len(graphs.frames())
+
+for path, count in sorted(found.items()):
+    if count != expected:
+        print("FAILED: %d frames in %s, expected %d" % (count, path, expected))
+        sys.exit(1)
+
+    print("OK: %d frames in %s" % (count, path))
+END
+[ $? -eq 0 ] || exit 1
+
+
+echo ""
+echo "#### RESULT STORE - STORED DATASETS AS INPUTS ####"
+echo ""
+
+NORM=plusone
+
+# the same frames saved as .dat files
+run python $BIN_DIR/calc_network.py --topology $PREFIX.pdb --threshold 7.0 --step 100 --calc-BC --discard-graphs $PREFIX.dcd
+
+run python $BIN_DIR/avg_network.py --data ${PREFIX}.store:bc --data-type BC --prefix store
+run python $BIN_DIR/avg_network.py --data ${PREFIX}_*_bc.dat --data-type BC --prefix dat
+
+run python $BIN_DIR/compare_networks.py --prefix store --reference ${PREFIX}.store:bc --alternative dat_BC_avg.dat
+
+run python $BIN_DIR/calc_delta_BC.py --normalize --normalization-mode ${NORM} --reference ${PREFIX}.store:bc:0 --alternatives ${PREFIX}.store:bc --output-store delta.store
+run python $BIN_DIR/calc_delta_BC.py --normalize --normalization-mode ${NORM} --reference ${PREFIX}_0_bc.dat --alternatives ${PREFIX}_*_bc.dat
+
+python - << END
+import sys, os
+sys.path.insert(0, "$BIN_DIR")
+
+import numpy as np
+
+from lib.store import ResultStore
+
+failed = False
+def check(name, ok):
+    global failed
+    failed = failed or not ok
+    print("%s: %s" % ("OK" if ok else "FAILED", name))
+
+# avg_network.py averages the frames of a dataset as it does the .dat files
+for stat in ("avg", "std_dev"):
+    check("avg_network.py ${PREFIX}.store:bc (%s)" % stat, np.allclose(np.loadtxt("store_BC_%s.dat" % stat), np.loadtxt("dat_BC_%s.dat" % stat)))
+
+# compare_networks.py compares the average of all stored frames
+check("compare_networks.py ${PREFIX}.store:bc", os.path.getsize("store_comp.png") > 0)
+
+# calc_delta_BC.py --output-store keeps the frames and times of the inputs
+with ResultStore("${PREFIX}.store") as inputs, ResultStore("delta.store") as deltas:
+    same = deltas.frames("delta_BC") == inputs.frames("bc")
+
+    for frame in deltas.frames("delta_BC") if same else ():
+        time = deltas.index["delta_BC"][frame][0]
+        same = same and time == inputs.index["bc"][frame][0]
+        same = same and np.allclose(deltas.read("delta_BC", frame), np.loadtxt("${PREFIX}_%d_bc_${NORM}_delta_BC.dat" % time))
+
+    check("calc_delta_BC.py ${PREFIX}.store:bc --output-store delta.store", same)
+
+sys.exit(1 if failed else 0)
+END
+[ $? -eq 0 ] || exit 1